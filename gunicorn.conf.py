@@ -0,0 +1,25 @@
+# Настройки gunicorn для Procfile: HTTP и WebSocket обслуживает ASGI-приложение (orthodox_dating/asgi.py)
+# в воркерах uvicorn. Каждый воркер — отдельный процесс со своим циклом событий, поэтому ожидающие
+# long-poll запросы и открытые сокеты не занимают по процессу на соединение.
+import multiprocessing
+import os
+from decouple import config
+
+wsgi_app = 'orthodox_dating.asgi:application'
+worker_class = 'orthodox_dating.workers.UvicornWorker'
+# Без Redis слой каналов, пробуждение long-poll (profiles/notifier.py) и присутствие живут в памяти
+# процесса и между воркерами не расходятся, поэтому без REDIS_URL воркер один
+if config('REDIS_URL', default=''):
+    workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    if workers != 1: raise RuntimeError(f'WEB_CONCURRENCY={workers} без REDIS_URL: несколько воркеров не увидят сообщений и событий друг друга')
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# long-poll держит запрос до 25 секунд (views.SYNC_TIMEOUT)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Перезапуск воркеров после N запросов (со случайным разбросом) ограничивает рост памяти
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
@@ -1,17 +1,21 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import profiles.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'orthodox_dating.settings')
+# Приложение Django создается до импорта консьюмеров: он настраивает реестр приложений
+django_application = get_asgi_application()
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import profiles.routing  # noqa: E402
+from profiles.middleware import WebsocketMetricsMiddleware  # noqa: E402
+from profiles.presence import PresenceMiddleware  # noqa: E402
+
+application = PresenceMiddleware(WebsocketMetricsMiddleware(ProtocolTypeRouter({
+    "http": django_application,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             profiles.routing.websocket_urlpatterns
         )
     ),
-})
-
+}), profiles.routing.websocket_urlpatterns))
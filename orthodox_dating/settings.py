@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url # <-- Импортируем
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -28,9 +29,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Метрики запросов (profiles/metrics.py) — первым, чтобы учитывать SQL всех остальных middleware
+    'profiles.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    # WhiteNoise должен быть сразу после SecurityMiddleware
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise должен быть сразу после SecurityMiddleware (обертка умеет работать без перевода цепочки в sync под ASGI)
+    'profiles.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,7 +55,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'profiles.context_processors.unread_notifications_count',
+                'profiles.context_processors.badge_counters',
             ],
         },
     },
@@ -61,22 +64,73 @@ TEMPLATES = [
 WSGI_APPLICATION = 'orthodox_dating.wsgi.application'
 ASGI_APPLICATION = 'orthodox_dating.asgi.application'
 
-# Настройки для Channels и Redis
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [config('REDIS_URL', default='redis://127.0.0.1:6379')],
+# Кэш (счетчики бейджей и т.п.): Redis, если задан REDIS_URL, иначе память процесса.
+# Отдельный кэш 'fragments' — отрендеренные куски страниц анкет (profiles/fragments.py); в Redis
+# его объем ограничивают maxmemory с политикой allkeys-lru
+REDIS_URL = config('REDIS_URL', default='')
+FRAGMENT_CACHE_TTL = config('FRAGMENT_CACHE_TTL', default=3600, cast=int)
+FRAGMENT_CACHE_MAX_ENTRIES = config('FRAGMENT_CACHE_MAX_ENTRIES', default=5000, cast=int)
+if REDIS_URL:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL},
+        'fragments': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL, 'KEY_PREFIX': 'fragments'},
+    }
+else:
+    # LocMemCache вытесняет давно не читанные записи (LRU), поэтому объем кэша фрагментов ограничен MAX_ENTRIES
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments',
+                      'OPTIONS': {'MAX_ENTRIES': FRAGMENT_CACHE_MAX_ENTRIES}},
+    }
+
+# Слой каналов (profiles/layers.py): Redis с пакетной рассылкой в группы, если задан REDIS_URL, иначе
+# память процесса — только для запуска в один процесс: без REDIS_URL gunicorn.conf.py запускает один воркер
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'profiles.layers.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'batch_window': config('CHANNEL_BATCH_WINDOW', default=0.0, cast=float),
+            },
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'profiles.layers.InProcessChannelLayer'}}
+
+# Фоновые задачи (profiles/taskqueue.py). В режиме EAGER задачи выполняются сразу после
+# коммита в самом запросе — удобно локально, когда воркер run_tasks не запущен. Отдельному
+# воркеру нужен REDIS_URL: без него слой каналов и счетчики бейджей живут в памяти процесса,
+# и уведомления из run_tasks не дошли бы до сокетов веб-воркера
+TASKS_EAGER = config('TASKS_EAGER', default=DEBUG or not REDIS_URL, cast=bool)
+if not TASKS_EAGER and not REDIS_URL:
+    raise ImproperlyConfigured('TASKS_EAGER=False без REDIS_URL: уведомления и счетчики из воркера run_tasks не дойдут до веб-процесса')
+# Выполненные и упавшие задачи старше стольких дней удаляет manage.py prune_tasks
+TASK_RETENTION_DAYS = config('TASK_RETENTION_DAYS', default=7, cast=int)
+
+# Холодный архив сообщений чата (profiles/archive.py, manage.py archive_messages)
+MESSAGE_ARCHIVE_DIR = config('MESSAGE_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+MESSAGE_ARCHIVE_AFTER_DAYS = config('MESSAGE_ARCHIVE_AFTER_DAYS', default=180, cast=int)
+
+# Прочитанные уведомления старше стольких дней удаляет manage.py prune_notifications
+NOTIFICATION_RETENTION_DAYS = config('NOTIFICATION_RETENTION_DAYS', default=90, cast=int)
+
+# Метрики на /metrics/ (доступ для персонала или с заголовком "Authorization: Bearer <METRICS_TOKEN>").
+# Профилирование: доля запросов под cProfile и порог, после которого профиль пишется в METRICS_PROFILE_DIR
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_PROFILE_SAMPLE_RATE = config('METRICS_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+METRICS_PROFILE_THRESHOLD_MS = config('METRICS_PROFILE_THRESHOLD_MS', default=1000, cast=int)
+METRICS_PROFILE_DIR = config('METRICS_PROFILE_DIR', default=str(BASE_DIR / 'profiles_dumps'))
 
 # --- НАСТРОЙКА БАЗЫ ДАННЫХ ---
 # Локально используется db.sqlite3
 # На сервере используется переменная окружения DATABASE_URL (PostgreSQL)
+# Под ASGI постоянные соединения не переиспользуются между запросами (каждый запрос работает в своем
+# потоке) и копятся, поэтому по умолчанию CONN_MAX_AGE=0; пул соединений — на стороне PgBouncer
 default_db_url = 'sqlite:///' + str(BASE_DIR / 'db.sqlite3')
 DATABASES = {
-    'default': dj_database_url.config(default=default_db_url, conn_max_age=600)
+    'default': dj_database_url.config(default=default_db_url, conn_max_age=config('DB_CONN_MAX_AGE', default=0, cast=int),
+                                      conn_health_checks=True)
 }
 
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Photo, Like, Message, Notification
+from .models import City, UserProfile, Photo, Like, Match, Message, Notification, Task
 
 class PhotoInline(admin.TabularInline):
     model = Photo
@@ -13,7 +13,7 @@ def make_verified(modeladmin, request, queryset):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'get_full_name', 'city', 'is_verified')
-    list_filter = ('is_verified', 'city', 'gender')
+    list_filter = ('is_verified', ('city_ref', admin.RelatedOnlyFieldListFilter), 'gender')
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'city')
     actions = [make_verified]
     inlines = [PhotoInline]
@@ -22,12 +22,20 @@ class UserProfileAdmin(admin.ModelAdmin):
     def get_full_name(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name}"
 
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    list_display = ('name', 'region', 'population', 'latitude', 'longitude')
+    list_filter = ('region',)
+    search_fields = ('name', 'region')
+
 admin.site.register(Like)
+admin.site.register(Match)
 admin.site.register(Message)
 admin.site.register(Notification)
 
-
-
-
-
-
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'duration_ms', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key')
+    readonly_fields = ('created_at', 'finished_at', 'duration_ms', 'last_error')
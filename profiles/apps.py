@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ProfilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'profiles'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Модули с @task должны быть импортированы, чтобы воркер очереди знал эти задачи
+        from . import notifications, images  # noqa: F401
+        # Учет SQL для метрик (profiles/metrics.py) на всех соединениях с БД, включая уже открытые
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from .metrics import install
+        connection_created.connect(install)
+        for connection in connections.all(initialized_only=True): install(connection)
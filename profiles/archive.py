@@ -0,0 +1,163 @@
+"""
+Холодный архив старых сообщений чата. Для каждого диалога (пары user_low < user_high) —
+два файла, которые только дописываются:
+
+    <low>_<high>.seg — блоки по BLOCK_SIZE сообщений, каждый сжат zlib отдельно;
+    <low>_<high>.idx — разреженный индекс: запись на блок (первый id, последний id, смещение, длина, число сообщений).
+
+Сообщения уходят в архив командой archive_messages; history_page в views читает блоки через mmap
+и сливает их с "горячими" строками из таблицы Message. Внутри диалога id в архиве только растут.
+"""
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from .lru import LRUCache
+
+BLOCK_SIZE = 256
+COMPRESS_LEVEL = 6
+INDEX_ENTRY = struct.Struct('<qqQII')   # first_id, last_id, offset, compressed length, count
+RECORD = struct.Struct('<qqqq?I')       # id, sender_id, receiver_id, timestamp (мкс UTC), is_read, длина текста
+
+# Распакованные блоки: архив только дописывается, поэтому блок по смещению никогда не меняется
+_blocks = LRUCache(2000)
+
+
+def _base(low, high):
+    root = settings.MESSAGE_ARCHIVE_DIR
+    # Шардируем по младшему id, чтобы в одном каталоге не оказались сотни тысяч файлов
+    return os.path.join(root, f'{low % 256:02x}', f'{low}_{high}')
+
+
+def _to_micros(value):
+    return int(value.timestamp()) * 1_000_000 + value.microsecond
+
+
+def _from_micros(value):
+    return datetime.fromtimestamp(value // 1_000_000, dt_timezone.utc).replace(microsecond=value % 1_000_000)
+
+
+def encode_block(rows):
+    parts = []
+    for row in rows:
+        content = row['content'].encode('utf-8')
+        parts.append(RECORD.pack(row['id'], row['sender_id'], row['receiver_id'], _to_micros(row['timestamp']), row['is_read'], len(content)))
+        parts.append(content)
+    return zlib.compress(b''.join(parts), COMPRESS_LEVEL)
+
+
+def decode_block(data):
+    raw, rows, pos = zlib.decompress(data), [], 0
+    while pos < len(raw):
+        message_id, sender_id, receiver_id, micros, is_read, length = RECORD.unpack_from(raw, pos)
+        pos += RECORD.size
+        rows.append({'id': message_id, 'sender_id': sender_id, 'receiver_id': receiver_id, 'timestamp': _from_micros(micros),
+                     'is_read': is_read, 'content': raw[pos:pos + length].decode('utf-8')})
+        pos += length
+    return rows
+
+
+class Segment:
+    """Архив одного диалога, открытый на чтение. Файлы отображаются в память целиком на момент открытия."""
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+        self.base = _base(low, high)
+        self.index = []
+        self._data = None
+        try:
+            with open(self.base + '.idx', 'rb') as f: raw = f.read()
+        except FileNotFoundError:
+            return
+        # Недописанная (оборванная) запись в конце индекса игнорируется
+        usable = len(raw) - len(raw) % INDEX_ENTRY.size
+        self.index = list(INDEX_ENTRY.iter_unpack(raw[:usable]))
+        if self.index:
+            with open(self.base + '.seg', 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): self.close()
+
+    def close(self):
+        if self._data is not None: self._data.close(); self._data = None
+
+    def block(self, entry):
+        _, _, offset, length, _ = entry
+        key = (self.low, self.high, offset)
+        rows = _blocks.get(key)
+        if rows is None:
+            rows = decode_block(self._data[offset:offset + length])
+            _blocks.set(key, rows)
+        return rows
+
+    def rows(self):
+        """Все сообщения архива по возрастанию id; блоки не кэшируются (разовый полный проход)."""
+        for _, _, offset, length, _ in self.index:
+            yield from decode_block(self._data[offset:offset + length])
+
+    def before(self, before, size):
+        """До size последних сообщений с id < before (before=None — с конца), от новых к старым."""
+        result = []
+        for entry in reversed(self.index):
+            if before is not None and entry[0] >= before: continue
+            for row in reversed(self.block(entry)):
+                if before is None or row['id'] < before:
+                    result.append(row)
+                    if len(result) == size: return result
+        return result
+
+    def ids_between(self, first_id, last_id):
+        ids = set()
+        for entry in self.index:
+            if entry[1] >= first_id and entry[0] <= last_id:
+                ids.update(row['id'] for row in self.block(entry))
+        return ids
+
+
+def append(low, high, rows):
+    """
+    Дописывает сообщения (по возрастанию id, все новее last_id архива) блоками по BLOCK_SIZE.
+    Сначала блок надежно пишется в .seg, потом запись в .idx: при сбое посередине блок
+    без индекса просто не виден читателям, а сообщения остаются в БД.
+    """
+    base = _base(low, high)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with open(base + '.seg', 'ab') as seg, open(base + '.idx', 'ab') as idx:
+        for start in range(0, len(rows), BLOCK_SIZE):
+            chunk = rows[start:start + BLOCK_SIZE]
+            data = encode_block(chunk)
+            offset = seg.seek(0, os.SEEK_END)
+            seg.write(data); seg.flush(); os.fsync(seg.fileno())
+            idx.write(INDEX_ENTRY.pack(chunk[0]['id'], chunk[-1]['id'], offset, len(data), len(chunk)))
+            idx.flush(); os.fsync(idx.fileno())
+
+
+def merge_history(hot_rows, low, high, before, size):
+    """
+    Дополняет "горячие" строки (от новых к старым, до size + 1 штук) архивными.
+    Архив читается, только если горячих строк не хватило или они заходят в диапазон архива.
+    """
+    if len(hot_rows) > size and hot_rows[-1]['id'] > last_archived_id(low, high): return hot_rows
+    with Segment(low, high) as segment:
+        if not segment.index: return hot_rows
+        cold_rows = segment.before(before, size + 1)
+    seen = {row['id'] for row in hot_rows}
+    merged = hot_rows + [row for row in cold_rows if row['id'] not in seen]
+    merged.sort(key=lambda row: row['id'], reverse=True)
+    return merged[:size + 1]
+
+
+def last_archived_id(low, high):
+    # Последняя запись индекса читается без mmap всего файла
+    try:
+        with open(_base(low, high) + '.idx', 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            size -= size % INDEX_ENTRY.size
+            if not size: return 0
+            f.seek(size - INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[1]
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,197 @@
+"""
+Нагрузочные замеры основных страниц и чата на синтетических данных (manage.py benchmark).
+Данные генерируются детерминированно (random.Random(seed)), поэтому прогоны сравнимы между собой.
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import date, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import UserProfile, Like, Match, Message, Notification, Conversation, normalize_city
+from . import bulk, gazetteer
+
+# Масштабы: анкет, симпатий от каждого пользователя, диалогов у "главного" пользователя,
+# сообщений в диалоге, уведомлений на пользователя
+SCALES = {
+    'small': {'profiles': 200, 'likes': 10, 'conversations': 20, 'messages': 100, 'notifications': 20},
+    'medium': {'profiles': 2000, 'likes': 30, 'conversations': 50, 'messages': 500, 'notifications': 50},
+    'large': {'profiles': 20000, 'likes': 50, 'conversations': 200, 'messages': 2000, 'notifications': 100},
+}
+CITIES = ('Москва', 'Санкт-Петербург', 'Екатеринбург', 'Казань', 'Нижний Новгород', 'Самара', 'Сергиев Посад', 'Псков')
+PASSWORD = 'benchmark'
+BATCH_SIZE = 1000
+LATENCY_SLACK_MS = 2  # абсолютный запас к допуску: на субмиллисекундных замерах шум больше самих значений
+
+
+def _choice(rng, choices):
+    return rng.choice(choices)[0]
+
+
+def seed(scale, seed=42):
+    """Заполняет пустую БД; возвращает id "главного" пользователя, от имени которого идут запросы."""
+    rng, now = random.Random(seed), timezone.now()
+    password = make_password(PASSWORD)  # хэш один на всех: pbkdf2 на каждого занял бы минуты
+    with transaction.atomic():
+        User.objects.bulk_create([User(username=f'bench{i}', first_name=f'Имя{i}', password=password) for i in range(scale['profiles'])], batch_size=BATCH_SIZE)
+        user_ids = list(User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True))
+        # Четные — мужчины, нечетные — женщины
+        men, women = user_ids[0::2], user_ids[1::2]
+        profiles = []
+        for i, user_id in enumerate(user_ids):
+            city = rng.choice(CITIES)
+            profiles.append(UserProfile(
+                user_id=user_id, gender='Мужчина' if i % 2 == 0 else 'Женщина', city=city, city_normalized=normalize_city(city), city_ref_id=gazetteer.resolve(city),
+                date_of_birth=date(1970, 1, 1) + timedelta(days=rng.randrange(365 * 35)), height=rng.randrange(150, 200),
+                marital_status=_choice(rng, UserProfile.MARITAL_STATUS_CHOICES), children=_choice(rng, UserProfile.CHILDREN_CHOICES),
+                churching_level=_choice(rng, UserProfile.CHURCHING_LEVEL_CHOICES), attitude_to_fasting=_choice(rng, UserProfile.ATTITUDE_TO_FASTING_CHOICES),
+                sacraments=_choice(rng, UserProfile.SACRAMENTS_CHOICES), about_me=f'Анкета номер {i}. ' * rng.randrange(1, 10),
+            ))
+        UserProfile.objects.bulk_create(profiles, batch_size=BATCH_SIZE)
+
+        main, partners = men[0], women[:scale['conversations']]
+        likes = {(main, partner) for partner in partners} | {(partner, main) for partner in partners}
+        men_set = set(men)
+        for user_id in user_ids:
+            others = women if user_id in men_set else men
+            likes.update((user_id, other) for other in rng.sample(others, min(scale['likes'], len(others))))
+        Like.objects.bulk_create([Like(user_from_id=a, user_to_id=b) for a, b in likes], batch_size=BATCH_SIZE)
+        pairs = {Conversation.pair(a, b) for a, b in likes if (b, a) in likes}
+        Match.objects.bulk_create([Match(user_low_id=low, user_high_id=high) for low, high in pairs], batch_size=BATCH_SIZE)
+
+        # Через bulk.insert_objects, а не bulk_create: он сохраняет заданные timestamp, а не ставит "сейчас"
+        start = now - timedelta(minutes=scale['messages'])
+        for partner in partners:
+            bulk.insert_objects(Message, [
+                Message(sender_id=main if n % 2 else partner, receiver_id=partner if n % 2 else main,
+                        content=f'Сообщение {n}', timestamp=start + timedelta(minutes=n), is_read=n < scale['messages'] - 5)
+                for n in range(scale['messages'])
+            ])
+        bulk.rebuild_conversations()
+
+        # Прочитанная история и одно непрочитанное уведомление, в которое слились последние симпатии
+        notifications = [Notification(recipient_id=user_id, sender_id=rng.choice(user_ids), message='Новая симпатия', notification_type='LIKE',
+                                      is_read=n > 0, count=5 if n == 0 else 1)
+                         for user_id in user_ids for n in range(scale['notifications'])]
+        Notification.objects.bulk_create(notifications, batch_size=BATCH_SIZE)
+    return main
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def summarize(durations, queries, elapsed):
+    durations = sorted(durations)
+    return {
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 2), 'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 2), 'queries': max(queries) if queries else None,
+        'rps': round(len(durations) / elapsed, 1),
+    }
+
+
+def view_scenarios(main_id):
+    """(имя, URL) для замеров через тестовый клиент от имени main_id."""
+    conversation = Conversation.for_user(User(id=main_id)).order_by('-last_activity').first()
+    partner_id = conversation.user_high_id if conversation.user_low_id == main_id else conversation.user_low_id
+    other_id = UserProfile.objects.filter(gender='Женщина').exclude(user_id=partner_id).values_list('user_id', flat=True).last()
+    since = conversation.last_activity - timedelta(minutes=5)
+    return [
+        ('profile_list', reverse('profiles:profile_list')),
+        ('profile_list_filtered', reverse('profiles:profile_list') + '?gender=Женщина&min_age=25&max_age=45'),
+        ('profile_detail', reverse('profiles:profile_detail', kwargs={'pk': other_id})),
+        ('inbox', reverse('profiles:inbox')),
+        ('conversation_detail', reverse('profiles:conversation_detail', kwargs={'pk': partner_id})),
+        ('get_new_messages', reverse('profiles:get_new_messages', kwargs={'pk': partner_id, 'last_timestamp': since.isoformat()})),
+        ('notification_list', reverse('profiles:notification_list')),
+    ]
+
+
+def run_view(client, url, iterations, warmup=3):
+    for _ in range(warmup): client.get(url)
+    durations, queries = [], []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            t = time.perf_counter()
+            response = client.get(url)
+            durations.append(time.perf_counter() - t)
+        if response.status_code != 200: raise RuntimeError(f'{url}: ответ {response.status_code}')
+        queries.append(len(captured))
+    return summarize(durations, queries, time.perf_counter() - started)
+
+
+def run_views(main_id, iterations):
+    client = Client()
+    client.force_login(User.objects.get(id=main_id))
+    return {name: run_view(client, url, iterations) for name, url in view_scenarios(main_id)}
+
+
+async def _chat(main_id, partner_id, iterations):
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from .routing import websocket_urlpatterns
+    from .writebehind import message_buffer
+    router = URLRouter(websocket_urlpatterns)
+    main, partner = await _users(main_id, partner_id)
+
+    def as_user(user):
+        # Вместо AuthMiddlewareStack: пользователь подставляется в scope напрямую, без сессии
+        async def application(scope, receive, send):
+            return await router({**scope, 'user': user}, receive, send)
+        return application
+    sender = WebsocketCommunicator(as_user(main), f'/ws/chat/{partner_id}/')
+    receiver = WebsocketCommunicator(as_user(partner), f'/ws/chat/{main_id}/')
+    for communicator in (sender, receiver):
+        connected, _ = await communicator.connect()
+        if not connected: raise RuntimeError('ChatConsumer отклонил соединение')
+    # Кадры присутствия после подключения в замер не входят
+    for communicator in (sender, receiver):
+        while not await communicator.receive_nothing(0.1): await communicator.receive_from()
+    durations = []
+    started = time.perf_counter()
+    for n in range(iterations):
+        t = time.perf_counter()
+        await sender.send_to(text_data=json.dumps({'message': f'Замер {n}'}))
+        await receiver.receive_json_from(timeout=5)
+        durations.append(time.perf_counter() - t)
+        await sender.receive_json_from(timeout=5)  # эхо отправителю
+    elapsed = time.perf_counter() - started
+    await message_buffer.flush()
+    await sender.disconnect(); await receiver.disconnect()
+    return summarize(durations, [], elapsed)
+
+
+def _users_sync(*ids):
+    users = User.objects.in_bulk(ids)
+    return [users[user_id] for user_id in ids]
+
+
+async def _users(*ids):
+    from channels.db import database_sync_to_async
+    return await database_sync_to_async(_users_sync)(*ids)
+
+
+def run_chat(main_id, iterations):
+    """Время доставки сообщения собеседнику через ChatConsumer (отправка -> получение)."""
+    partner_id = Conversation.for_user(User(id=main_id)).values_list('user_high_id', flat=True).first()
+    return asyncio.run(_chat(main_id, partner_id, iterations))
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий: запросов больше, чем в эталоне, или p95 хуже эталона более чем на tolerance (плюс LATENCY_SLACK_MS)."""
+    failures = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if actual is None: continue
+        if expected.get('queries') is not None and actual['queries'] is not None and actual['queries'] > expected['queries']:
+            failures.append(f'{name}: {actual["queries"]} запросов, эталон {expected["queries"]}')
+        if actual['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + LATENCY_SLACK_MS:
+            failures.append(f'{name}: p95 {actual["p95_ms"]} мс, эталон {expected["p95_ms"]} мс (+{tolerance:.0%})')
+    return failures
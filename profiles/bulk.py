@@ -0,0 +1,107 @@
+"""
+Массовая загрузка строк в обход ORM-сохранения (manage.py import_data, заполнение БД для замеров).
+На PostgreSQL строки идут через COPY FROM STDIN, на остальных СУБД — одним executemany INSERT.
+Значения auto_now_add, не заданные явно, заполняются текущим временем, а заданные — сохраняются
+как есть (bulk_create перезаписал бы их), поэтому можно загружать историю с реальными датами.
+"""
+import csv
+import io
+import json
+from itertools import islice
+from django.db import connections, router, transaction
+from django.db.models import Max, Q, F, Exists, OuterRef
+from django.db.models.functions import Least, Greatest
+from django.utils import timezone
+from .models import Like, Match, Message, Conversation
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def read_records(path, fmt=None):
+    """Построчно читает CSV (с заголовком) или JSONL; весь файл в память не загружается."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            # Пустые ячейки CSV считаются отсутствующими значениями
+            for row in csv.DictReader(f): yield {key: value for key, value in row.items() if value != ''}
+        else:
+            for line in f:
+                if line.strip(): yield json.loads(line)
+
+
+def insert_objects(model, objs, using=None):
+    """Вставляет несохраненные экземпляры model без получения id; возвращает число строк."""
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    now = timezone.now()
+    rows = []
+    for obj in objs:
+        row = []
+        for field in fields:
+            value = getattr(obj, field.attname)
+            if value is None and (getattr(field, 'auto_now_add', False) or getattr(field, 'auto_now', False)): value = now
+            row.append(field.get_db_prep_save(value, connection))
+        rows.append(row)
+    if not rows: return 0
+    table, columns = model._meta.db_table, [field.column for field in fields]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql': _copy(cursor, connection, table, columns, rows)
+        else:
+            quote = connection.ops.quote_name
+            sql = f'INSERT INTO {quote(table)} ({", ".join(map(quote, columns))}) VALUES ({", ".join(["%s"] * len(columns))})'
+            cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def _copy(cursor, connection, table, columns, rows):
+    quote = connection.ops.quote_name
+    sql = f'COPY {quote(table)} ({", ".join(map(quote, columns))}) FROM STDIN'
+    raw = cursor.cursor
+    if hasattr(raw, 'copy'):  # psycopg 3
+        with raw.copy(sql) as copy:
+            for row in rows: copy.write_row(row)
+        return
+    # psycopg2: CSV, где строки всегда в кавычках, а NULL — пустое поле без кавычек
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows: writer.writerow(['t' if value is True else 'f' if value is False else value for value in row])
+    buffer.seek(0)
+    raw.copy_expert(sql + ' WITH (FORMAT csv)', buffer)
+
+
+def rebuild_matches(batch_size=5000):
+    """Создает недостающие Match по встречным Like; возвращает число пар."""
+    reverse = Like.objects.filter(user_from_id=OuterRef('user_to_id'), user_to_id=OuterRef('user_from_id'))
+    mutual = Like.objects.filter(user_from_id__lt=F('user_to_id')).filter(Exists(reverse)).values_list('user_from_id', 'user_to_id')
+    total = 0
+    for batch in batched(mutual.iterator(chunk_size=batch_size), batch_size):
+        Match.objects.bulk_create([Match(user_low_id=low, user_high_id=high) for low, high in batch], ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+def rebuild_conversations(batch_size=5000):
+    """Пересчитывает сводки Conversation по всей таблице Message одним агрегирующим проходом."""
+    low, high = Least('sender_id', 'receiver_id'), Greatest('sender_id', 'receiver_id')
+    pairs = (Message.objects.annotate(low=low, high=high).values('low', 'high').order_by()
+             .annotate(last_id=Max('id'),
+                       # Водяной знак — последнее входящее, помеченное прочитанным в исходных данных
+                       read_low=Max('id', filter=Q(is_read=True, receiver_id=F('low'))),
+                       read_high=Max('id', filter=Q(is_read=True, receiver_id=F('high')))))
+    total = 0
+    for batch in batched(pairs.iterator(chunk_size=batch_size), batch_size):
+        last = Message.objects.only('content', 'timestamp').in_bulk([row['last_id'] for row in batch])
+        Conversation.objects.bulk_create([
+            Conversation(user_low_id=row['low'], user_high_id=row['high'], last_message_id=row['last_id'],
+                         preview=last[row['last_id']].content[:Conversation.PREVIEW_LENGTH], last_activity=last[row['last_id']].timestamp,
+                         read_low=row['read_low'] or 0, read_high=row['read_high'] or 0)
+            for row in batch
+        ], update_conflicts=True, unique_fields=['user_low', 'user_high'],
+           update_fields=['last_message', 'preview', 'last_activity', 'read_low', 'read_high'])
+        total += len(batch)
+    return total
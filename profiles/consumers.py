@@ -1,19 +1,64 @@
+import asyncio
 import json
+import logging
+import time
+from asgiref.sync import async_to_sync
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
 from django.contrib.auth.models import User
-from .models import Message
+from django.utils import timezone
+from .models import Message, Match, Conversation
+from .notifications import user_group, plural
+from .writebehind import message_buffer
+from . import counters, presence
 from channels.db import database_sync_to_async
 
+logger = logging.getLogger(__name__)
+
+
+def room_group(a_id, b_id):
+    # Имя одинаково для обоих собеседников
+    return 'chat_%s_%s' % Conversation.pair(a_id, b_id)
+
+
+def read_receipt(user_id, message_id):
+    """Событие группы комнаты: user_id прочитал диалог до message_id включительно."""
+    return {'type': 'chat_read', 'user_id': user_id, 'frame': json.dumps({'type': 'read', 'user_id': user_id, 'message_id': message_id})}
+
+
+def mark_read(user_id, interlocutor_id, message_id):
+    """Сдвигает водяной знак прочитанного; если он сдвинулся, сбрасывает бейдж и возвращает True."""
+    if not Conversation.mark_read(user_id, interlocutor_id, message_id): return False
+    counters.invalidate(counters.MESSAGES, user_id)
+    return True
+
+
+def push_read_receipt(user_id, interlocutor_id, message_id):
+    """Отправка отметки о прочтении собеседнику из синхронного кода (вьюхи)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None: return
+    try:
+        async_to_sync(channel_layer.group_send)(room_group(user_id, interlocutor_id), read_receipt(user_id, message_id))
+    except Exception:  # отметка уже в БД, собеседник увидит ее при следующей загрузке
+        logger.exception('Не удалось отправить отметку о прочтении в диалог %s', room_group(user_id, interlocutor_id))
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Кадры «печатает…» от одного соединения — не чаще раза в TYPING_INTERVAL секунд
+    TYPING_INTERVAL = 2.0
+
     async def connect(self):
         # Получаем ID собеседника из URL
-        self.interlocutor_id = self.scope['url_route']['kwargs']['pk']
+        self.interlocutor_id = int(self.scope['url_route']['kwargs']['pk'])
         self.user = self.scope['user']
-        
-        # Создаем уникальное имя для комнаты чата
-        # Сортируем ID, чтобы имя было одинаковым для обоих пользователей
-        user_ids = sorted([int(self.user.id), int(self.interlocutor_id)])
-        self.room_group_name = f'chat_{user_ids[0]}_{user_ids[1]}'
+        self.room_group_name = None
+
+        # Собеседник проверяется один раз на соединение: писать можно только при взаимной симпатии
+        if not self.user.is_authenticated or not await self.can_chat():
+            await self.close()
+            return
+
+        self.room_group_name = room_group(self.user.id, self.interlocutor_id)
 
         # Присоединяемся к группе комнаты
         await self.channel_layer.group_add(
@@ -22,8 +67,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        self.last_typing = 0.0
+        await presence.tracker.publish('join', self.user.id, self.channel_name)
+        await self.announce_presence()
+        await self.send_presence()
 
     async def disconnect(self, close_code):
+        if self.room_group_name is None: return
+        # Дописываем в БД все, что еще лежит в буфере
+        await message_buffer.flush()
+        await presence.tracker.publish('leave', self.user.id, self.channel_name)
+        await self.announce_presence()
         # Отсоединяемся от группы комнаты
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -33,37 +87,123 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # Получаем сообщение от WebSocket (от браузера)
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        message_content = text_data_json['message']
+        frame_type = text_data_json.get('type')
+        if frame_type == 'heartbeat':
+            # Продлеваем присутствие и заодно сообщаем актуальный статус собеседника
+            await presence.tracker.publish('beat', self.user.id, self.channel_name)
+            await self.send_presence()
+            return
+        if frame_type == 'typing':
+            # Только в группу комнаты, в БД не пишется
+            now = time.monotonic()
+            if now - self.last_typing < self.TYPING_INTERVAL: return
+            self.last_typing = now
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_typing', 'user_id': self.user.id, 'frame': json.dumps({'type': 'typing', 'user_id': self.user.id}),
+            })
+            return
+        if frame_type == 'read':
+            # Отметка о прочтении: браузер сообщает id последнего показанного входящего сообщения
+            message_id = text_data_json.get('message_id')
+            if not isinstance(message_id, int) or message_id <= 0: return
+            if await database_sync_to_async(mark_read)(self.user.id, self.interlocutor_id, message_id):
+                await self.channel_layer.group_send(self.room_group_name, read_receipt(self.user.id, message_id))
+            return
+        message_content = text_data_json.get('message', '').strip()
+        if not message_content: return
 
-        # Сохраняем сообщение в базу данных
-        new_message = await self.save_message(message_content)
+        new_message = Message(sender_id=self.user.id, receiver_id=self.interlocutor_id, content=message_content, timestamp=timezone.now())
 
-        # Отправляем сообщение всем в группе комнаты
+        # Сначала рассылаем сообщение всем в группе комнаты...
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': new_message.content,
-                'sender_id': new_message.sender.id,
-                'timestamp': new_message.timestamp.strftime('%H:%M')
+                # Кадр для браузера собирается один раз, а не в каждом консьюмере-получателе
+                'frame': json.dumps({
+                    'message': new_message.content,
+                    'sender_id': new_message.sender_id,
+                    'timestamp': timezone.localtime(new_message.timestamp).strftime('%H:%M')
+                }),
             }
         )
-    
+        # ...а в базу оно попадет пачкой через буфер отложенной записи
+        message_buffer.add(new_message)
+
     # Обработчик для отправки сообщения обратно в WebSocket (в браузер)
     async def chat_message(self, event):
         # Отправляем сообщение в WebSocket
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'sender_id': event['sender_id'],
-            'timestamp': event['timestamp']
-        }))
+        await self.send(text_data=event['frame'])
+
+    async def chat_typing(self, event):
+        if event['user_id'] != self.user.id: await self.send(text_data=event['frame'])
+
+    async def chat_read(self, event):
+        if event['user_id'] != self.user.id: await self.send(text_data=event['frame'])
+
+    async def chat_presence(self, event):
+        if event['user_id'] != self.user.id: await self.send(text_data=event['frame'])
+
+    async def announce_presence(self):
+        # Статус считается после события: при второй открытой вкладке уход из одной не делает пользователя офлайн
+        state = presence.payload(presence.tracker.get(self.user.id))
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_presence', 'user_id': self.user.id, 'frame': json.dumps({'type': 'presence', 'user_id': self.user.id, **state}),
+        })
+
+    async def send_presence(self):
+        state = presence.payload(presence.tracker.get(self.interlocutor_id))
+        await self.send(text_data=json.dumps({'type': 'presence', 'user_id': self.interlocutor_id, **state}))
 
     @database_sync_to_async
-    def save_message(self, message_content):
-        interlocutor = User.objects.get(id=self.interlocutor_id)
-        new_msg = Message.objects.create(
-            sender=self.user,
-            receiver=interlocutor,
-            content=message_content
-        )
-        return new_msg
+    def can_chat(self):
+        interlocutor = User.objects.filter(id=self.interlocutor_id).first()
+        return interlocutor is not None and Match.exists_between(self.user, interlocutor)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    # Уведомления, пришедшие в течение этого окна, уходят в браузер одним кадром
+    COALESCE_WINDOW = 1.5
+    SUMMARY_FORMS = {
+        'LIKE': ('новая симпатия', 'новые симпатии', 'новых симпатий'),
+        'MESSAGE': ('новое сообщение', 'новых сообщения', 'новых сообщений'),
+    }
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = user_group(self.user.id)
+        self.pending = []
+        self.flush_task = None
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if not self.user.is_authenticated: return
+        if self.flush_task: self.flush_task.cancel()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # Обработчик события из группы user_<id>: копим уведомления и отправляем пачкой
+    async def notification_created(self, event):
+        self.pending.append(event)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.COALESCE_WINDOW)
+        pending, self.pending, self.flush_task = self.pending, [], None
+        await self.send(text_data=json.dumps({'count': len(pending), 'items': self.summarize(pending)}))
+
+    def summarize(self, events):
+        by_type = {}
+        for event in events: by_type.setdefault(event['notification_type'], []).append(event)
+        items = []
+        for notification_type, group in by_type.items():
+            if len(group) == 1:
+                items.append({'notification_type': notification_type, 'message': group[0]['message'], 'link': group[0]['link'], 'count': 1})
+            else:
+                forms = self.SUMMARY_FORMS.get(notification_type, ('новое уведомление', 'новых уведомления', 'новых уведомлений'))
+                items.append({'notification_type': notification_type, 'message': f'{len(group)} {plural(len(group), forms)}', 'link': None, 'count': len(group)})
+        return items
@@ -1,12 +1,6 @@
-from .models import Notification
+from .counters import BadgeCounters
 
-def unread_notifications_count(request):
+def badge_counters(request):
     if request.user.is_authenticated:
-        count = Notification.objects.filter(recipient=request.user, is_read=False).count()
-        return {'unread_notifications_count': count}
+        return {'badges': BadgeCounters(request.user)}
     return {}
-
-
-
-
-
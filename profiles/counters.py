@@ -0,0 +1,90 @@
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from .models import Conversation, Notification
+
+# Счетчики для бейджей в шапке сайта
+NOTIFICATIONS, MESSAGES, LIKES = 'notifications', 'messages', 'likes'
+KINDS = (NOTIFICATIONS, MESSAGES, LIKES)
+# Ключ живет ограниченное время: после истечения значение пересчитывается из БД,
+# так что расхождения (например, между процессами с локальным кэшем) не копятся
+COUNTER_TTL = 60 * 60
+
+
+def _key(kind, user_id):
+    return f'badge:{kind}:{user_id}'
+
+
+def count_from_db(kind, user_id):
+    # Уведомление может объединять несколько событий: считаются события, а не строки
+    if kind == NOTIFICATIONS:
+        return Notification.objects.filter(recipient_id=user_id, is_read=False).aggregate(total=Sum('count'))['total'] or 0
+    if kind == LIKES:
+        return Notification.objects.filter(recipient_id=user_id, is_read=False, notification_type='LIKE').aggregate(total=Sum('count'))['total'] or 0
+    if kind == MESSAGES:
+        return Conversation.unread_totals([user_id])[user_id]
+    raise ValueError(f'Неизвестный счетчик: {kind}')
+
+
+def get_many(user_id, kinds=KINDS):
+    keys = {_key(kind, user_id): kind for kind in kinds}
+    cached = cache.get_many(keys)
+    values = {keys[key]: max(0, value) for key, value in cached.items()}
+    missing = {kind: count_from_db(kind, user_id) for kind in kinds if kind not in values}
+    if missing: cache.set_many({_key(kind, user_id): value for kind, value in missing.items()}, COUNTER_TTL)
+    return {**values, **missing}
+
+
+def get(kind, user_id):
+    return get_many(user_id, (kind,))[kind]
+
+
+def incr(kind, user_id, delta=1):
+    """Write-through инкремент. Если ключа нет в кэше, ничего не делаем: его пересчитают при чтении."""
+    try: cache.incr(_key(kind, user_id), delta)
+    except ValueError: pass
+
+
+def reset(kind, user_id, value=0):
+    cache.set(_key(kind, user_id), value, COUNTER_TTL)
+
+
+def invalidate(kind, user_id):
+    cache.delete(_key(kind, user_id))
+
+
+async def ainvalidate(kind, user_id):
+    await cache.adelete(_key(kind, user_id))
+
+
+def reconcile(user_ids):
+    """Пересчитывает все счетчики для пачки пользователей тремя запросами."""
+    user_ids = list(user_ids)
+    values = {(kind, user_id): 0 for kind in KINDS for user_id in user_ids}
+    unread = Notification.objects.filter(recipient_id__in=user_ids, is_read=False).values('recipient_id')
+    for row in unread.annotate(total=Sum('count'), likes=Sum('count', filter=Q(notification_type='LIKE'))):
+        values[NOTIFICATIONS, row['recipient_id']] = row['total']
+        values[LIKES, row['recipient_id']] = row['likes'] or 0
+    for user_id, total in Conversation.unread_totals(user_ids).items(): values[MESSAGES, user_id] = total
+    cache.set_many({_key(kind, user_id): value for (kind, user_id), value in values.items()}, COUNTER_TTL)
+    return len(user_ids)
+
+
+class BadgeCounters:
+    """Ленивый объект для шаблонов: кэш читается только при первом обращении к любому счетчику."""
+    def __init__(self, user):
+        self.user = user
+        self._values = None
+
+    def _get(self, kind):
+        if not self.user.is_authenticated: return 0
+        if self._values is None: self._values = get_many(self.user.id)
+        return self._values[kind]
+
+    @property
+    def notifications(self): return self._get(NOTIFICATIONS)
+
+    @property
+    def messages(self): return self._get(MESSAGES)
+
+    @property
+    def likes(self): return self._get(LIKES)
@@ -0,0 +1,108 @@
+"""
+Выгрузка всех данных пользователя одним ZIP-архивом, который собирается на лету:
+zipfile пишет в неперематываемый поток, а готовые куски сразу уходят клиенту через
+StreamingHttpResponse. Строки читаются курсором (.iterator()), фото — кусками из хранилища,
+поэтому память не зависит от объема переписки. Под ASGI отдается astream(): синхронный генератор
+StreamingHttpResponse сначала вычитал бы целиком (sync_to_async(list)) и только потом начал отдачу.
+
+    profile.json, likes_sent.jsonl, likes_received.jsonl, matches.jsonl,
+    messages.jsonl (включая архивные), notifications.jsonl, photos/...
+"""
+import json
+import zipfile
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.forms.models import model_to_dict
+from django.utils import timezone
+from . import archive
+from .models import UserProfile, Like, Match, Message, Conversation, Notification, Photo
+
+CHUNK_SIZE = 64 * 1024
+ITERATOR_CHUNK = 2000
+MESSAGE_FIELDS = ('id', 'sender_id', 'receiver_id', 'content', 'timestamp', 'is_read')
+
+
+class _Sink:
+    """Неперематываемый поток для zipfile: копит записанное до следующей выдачи клиенту."""
+    def __init__(self):
+        self.parts, self.size = [], 0
+
+    def write(self, data):
+        self.parts.append(bytes(data)); self.size += len(data)
+        return len(data)
+
+    def flush(self): pass
+
+    def pop(self):
+        data, self.parts, self.size = b''.join(self.parts), [], 0
+        return data
+
+
+def _line(record):
+    return (json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def stream(user):
+    """Генератор байтов ZIP-архива с данными user."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in _entries(user):
+            info = zipfile.ZipInfo(name, timezone.localtime().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if sink.size >= CHUNK_SIZE: yield sink.pop()
+            if sink.size: yield sink.pop()
+    yield sink.pop()
+
+
+async def astream(user):
+    """stream() для ASGI: генератор продвигается на один кусок за вызов в потоке для синхронного кода."""
+    chunks = stream(user)
+    try:
+        while (chunk := await sync_to_async(next)(chunks, None)) is not None: yield chunk
+    finally:
+        # Клиент оборвал загрузку: закрываем курсоры и zipfile в том же потоке
+        await sync_to_async(chunks.close)()
+
+
+def _entries(user):
+    profile = UserProfile.objects.filter(user=user).first()
+    yield 'profile.json', [json.dumps({
+        'user': {'username': user.username, 'first_name': user.first_name, 'last_name': user.last_name,
+                 'email': user.email, 'date_joined': user.date_joined},
+        'profile': model_to_dict(profile, exclude=['id', 'user', 'photo']) if profile else None,
+    }, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2).encode('utf-8')]
+    yield 'likes_sent.jsonl', _rows(Like.objects.filter(user_from=user).order_by('id').values('user_to_id', 'created_at'))
+    yield 'likes_received.jsonl', _rows(Like.objects.filter(user_to=user).order_by('id').values('user_from_id', 'created_at'))
+    yield 'matches.jsonl', _rows(Match.for_user(user).order_by('id').values('user_low_id', 'user_high_id', 'created_at'))
+    yield 'messages.jsonl', _messages(user)
+    yield 'notifications.jsonl', _rows(Notification.objects.filter(recipient=user).order_by('id')
+                                       .values('sender_id', 'notification_type', 'message', 'count', 'is_read', 'created_at'))
+    if profile is None: return
+    files = [profile.photo] if profile.photo and profile.photo.name != UserProfile._meta.get_field('photo').default else []
+    files += [photo.image for photo in Photo.objects.filter(user_profile=profile).order_by('id')]
+    for field_file in files:
+        yield f'photos/{field_file.name}', _file_chunks(field_file)
+
+
+def _rows(queryset):
+    for record in queryset.iterator(chunk_size=ITERATOR_CHUNK): yield _line(record)
+
+
+def _messages(user):
+    # Диалог за диалогом: сначала холодный архив, затем строки из таблицы
+    pairs = Conversation.for_user(user).order_by('id').values_list('user_low_id', 'user_high_id')
+    for low, high in pairs.iterator(chunk_size=ITERATOR_CHUNK):
+        with archive.Segment(low, high) as segment:
+            for row in segment.rows(): yield _line({field: row[field] for field in MESSAGE_FIELDS})
+        yield from _rows(Message.between(low, high).order_by('id').values(*MESSAGE_FIELDS))
+
+
+def _file_chunks(field_file):
+    try:
+        with field_file.storage.open(field_file.name, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE): yield chunk
+    except FileNotFoundError:
+        return
@@ -64,8 +64,12 @@ class ProfileFilterForm(forms.Form):
     gender = forms.ChoiceField(label="Пол", choices=GENDER_CHOICES, required=False)
     min_age = forms.IntegerField(label="Возраст от", min_value=18, required=False)
     max_age = forms.IntegerField(label="Возраст до", min_value=18, required=False)
+    RADIUS_CHOICES = [('', 'Только этот город'), (25, 'До 25 км'), (50, 'До 50 км'), (100, 'До 100 км'), (200, 'До 200 км'), (500, 'До 500 км')]
     city = forms.CharField(label="Город", max_length=100, required=False)
+    radius = forms.TypedChoiceField(label="Расстояние", choices=RADIUS_CHOICES, coerce=int, empty_value=None, required=False,
+                                    help_text="Без города — от вашего города")
     churching_level = forms.ChoiceField(label="Воцерковленность", choices=CHURCHING_CHOICES, required=False)
+    q = forms.CharField(label="Слова из анкеты", max_length=200, required=False, help_text="Ищется в полях «О себе», «Любимые святые» и «Любимые духовные книги»")
 
 class PhotoForm(forms.ModelForm):
     class Meta:
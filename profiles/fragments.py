@@ -0,0 +1,89 @@
+"""
+Кэш отрендеренных фрагментов анкет: карточка в списках и блоки страницы профиля
+({% profilecache %} из templatetags/profile_cache.py), в отдельном кэше settings.CACHES['fragments'].
+
+Ключ фрагмента — id пользователя и версия его анкеты. Версия лежит в том же кэше и меняется
+сигналами post_save/post_delete у UserProfile, Photo и User (signals.py), поэтому старые фрагменты
+просто перестают читаться и вытесняются по LRU/TTL. Версия — время смены в наносекундах, а не
+счетчик: если ключ версии вытеснят, новое значение не совпадет ни с одним прежним.
+
+Промах по популярной анкете не порождает толпу одинаковых рендеров: рендерит тот, кто взял
+блокировку (cache.add), остальные недолго ждут готовый фрагмент. Попадания, промахи и ожидания
+считаются в метриках (/metrics/, fragment_cache_requests_total).
+"""
+import time
+from datetime import date
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import registry
+
+CACHE_ALIAS = 'fragments'
+LOCK_TTL = 10        # секунд: блокировка рендера переживет упавший процесс не дольше этого
+LOCK_WAIT = 0.5      # сколько ждать чужой рендер, прежде чем отрендерить самому
+POLL_INTERVAL = 0.02
+
+registry.describe('fragment_cache_requests_total', 'counter', 'Обращения к кэшу фрагментов анкет: hit, miss, wait (дождались чужого рендера), timeout')
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'profile:version:{user_id}'
+
+
+def _key(name, user_id, version):
+    # В карточках выводится возраст, поэтому фрагменты живут не дольше суток
+    return f'profile:{name}:{user_id}:{version}:{date.today():%Y%m%d}'
+
+
+def invalidate(user_id):
+    _cache().set(_version_key(user_id), time.time_ns(), None)
+
+
+def versions(user_ids):
+    """{user_id: версия}; для анкет без версии она заводится."""
+    cache = _cache()
+    keys = {_version_key(user_id): user_id for user_id in user_ids}
+    found = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    for key, user_id in keys.items():
+        if user_id in found: continue
+        # add, а не set: не затереть версию, которую только что поменял сигнал
+        version = time.time_ns()
+        found[user_id] = version if cache.add(key, version, None) else cache.get(key, version)
+    return found
+
+
+def prefetch(names, user_ids):
+    """Версии и готовые фрагменты для страницы двумя запросами к кэшу: {(name, user_id): (версия, html или None)}."""
+    current = versions(user_ids)
+    keys = {_key(name, user_id, version): (name, user_id) for user_id, version in current.items() for name in names}
+    found = _cache().get_many(keys)
+    return {(name, user_id): (current[user_id], found.get(key)) for key, (name, user_id) in keys.items()}
+
+
+def get_or_render(name, user_id, version, render, cached=None):
+    cache = _cache()
+    key = _key(name, user_id, version)
+    html = cached if cached is not None else cache.get(key)
+    if html is not None: return _count(name, 'hit', html)
+    lock = f'{key}:lock'
+    if not cache.add(lock, 1, LOCK_TTL):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            html = cache.get(key)
+            if html is not None: return _count(name, 'wait', html)
+        return _count(name, 'timeout', render())
+    try:
+        html = render()
+        cache.set(key, html, settings.FRAGMENT_CACHE_TTL)
+    finally:
+        cache.delete(lock)
+    return _count(name, 'miss', html)
+
+
+def _count(name, result, html):
+    registry.inc('fragment_cache_requests_total', (('fragment', name), ('result', result)))
+    return html
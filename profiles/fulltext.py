@@ -0,0 +1,93 @@
+"""
+Полнотекстовый поиск по анкетам (about_me, favorite_saints, spiritual_books) с ранжированием.
+
+PostgreSQL: генерируемый столбец search_vector (tsvector с русской морфологией, веса
+A — святые, B — книги, C — о себе) и GIN-индекс по нему; столбец пересчитывает сама СУБД.
+SQLite: отдельная таблица FTS5 profiles_userprofile_fts (rowid = id анкеты), которую
+обновляют сигналы сохранения и удаления анкеты. Русских словарей в FTS5 нет, поэтому слова
+запроса усекаются простым стеммером и ищутся по префиксу.
+Оба варианта создаются миграцией 0007_profile_fulltext.
+"""
+import re
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'profiles_userprofile_fts'
+FIELDS = ('favorite_saints', 'spiritual_books', 'about_me')
+SQLITE_WEIGHTS = (3.0, 2.0, 1.0)  # в порядке FIELDS, как веса A/B/C в PostgreSQL
+
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иях', 'ость', 'ости',
+    'ах', 'ях', 'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ам', 'ям', 'ом', 'ем',
+    'ую', 'юю', 'ых', 'их', 'ию', 'ия', 'ье', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def supported():
+    return connection.vendor in ('postgresql', 'sqlite')
+
+
+def _fold(text):
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM: return word[:-len(ending)]
+    return word
+
+
+def fts5_query(text):
+    """Строка запроса FTS5: все слова обязательны, каждое — по префиксу основы."""
+    words = re.findall(r'\w+', _fold(text).lower())
+    return ' '.join(f'"{stem(word)}"*' for word in words)
+
+
+def search(queryset, text):
+    """Оставляет анкеты, подходящие под запрос, и добавляет аннотацию rank (больше — лучше)."""
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        return (queryset.alias(fts_match=RawSQL(f'"{table}"."search_vector" @@ {tsquery}', [text], output_field=BooleanField()))
+                .filter(fts_match=True)
+                # ts_rank возвращает real: курсор пагинации хранит rank как float8, и без приведения
+                # сравнение rank = %s на границе страницы промахивалось бы
+                .annotate(rank=RawSQL(f'ts_rank("{table}"."search_vector", {tsquery})::float8', [text], output_field=FloatField())))
+    if connection.vendor == 'sqlite':
+        query = fts5_query(text)
+        if not query: return queryset.none()
+        weights = ', '.join(map(str, SQLITE_WEIGHTS))
+        # bm25 тем меньше, чем лучше совпадение, поэтому берем со знаком минус
+        return (queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [query]))
+                .annotate(rank=RawSQL(f'(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id")',
+                                      [query], output_field=FloatField())))
+    # Прочие СУБД: без индекса и без ранжирования
+    condition = Q()
+    for word in text.split(): condition &= Q(about_me__icontains=word) | Q(favorite_saints__icontains=word) | Q(spiritual_books__icontains=word)
+    return queryset.filter(condition)
+
+
+def update(profile):
+    if connection.vendor != 'sqlite': return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [profile.id])
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FIELDS)}) VALUES (%s, %s, %s, %s)',
+                       [profile.id, *(_fold(getattr(profile, field)) for field in FIELDS)])
+
+
+def remove(profile_id):
+    if connection.vendor != 'sqlite': return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [profile_id])
+
+
+def rebuild(using_connection=None):
+    """Перестраивает индекс SQLite целиком (после массовой загрузки в обход сигналов)."""
+    conn = using_connection or connection
+    if conn.vendor != 'sqlite': return
+    folded = ', '.join(f"replace(replace({field}, 'ё', 'е'), 'Ё', 'Е')" for field in FIELDS)
+    with conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FIELDS)}) SELECT id, {folded} FROM profiles_userprofile')
@@ -0,0 +1,135 @@
+"""
+Встроенный справочник населенных пунктов (profiles/data/cities.csv) и поиск анкет в радиусе.
+
+Свободный текст поля «Город» при сохранении анкеты сводится к id из справочника: регистр, ё,
+приставки вроде «г.» и уточнения после запятой отбрасываются, учитываются прежние и разговорные
+названия (aliases). Справочник копируется в таблицу City миграцией 0008 и командой load_cities;
+id в файле постоянные, поэтому сопоставление идет по файлу, без запросов к БД.
+
+Для поиска в радиусе у каждого города хранится geohash. Круг радиуса r покрывается ячейкой,
+в которую попал центр, и восемью соседними той точности, при которой ячейка не меньше r, —
+это несколько диапазонных выборок по индексу geohash__startswith; точное расстояние
+проверяется уже для найденных городов, а анкеты выбираются по индексу city_ref.
+"""
+import csv
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'cities.csv'
+GEOHASH_PRECISION = 6
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PREFIXES = re.compile(r'^(?:г|гор|город|пгт|пос|поселок|с|село|д|деревня|ст|станица)\.?\s+')
+
+
+def city_key(value):
+    """Ключ для сопоставления: «г. Ростов-на-Дону, Россия» -> «ростов на дону»."""
+    value = (value or '').split(',')[0].lower().replace('ё', 'е')
+    value = ' '.join(re.sub(r'[^\w\s]', ' ', value.replace('.', '. ')).split())
+    return PREFIXES.sub('', value)
+
+
+def read_cities(path=DATA_FILE):
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            latitude, longitude = float(row['latitude']), float(row['longitude'])
+            yield {
+                'id': int(row['id']), 'name': row['name'], 'region': row['region'],
+                'latitude': latitude, 'longitude': longitude, 'population': int(row['population'] or 0),
+                'geohash': geohash(latitude, longitude), 'aliases': [alias for alias in row['aliases'].split('|') if alias],
+            }
+
+
+@lru_cache(maxsize=1)
+def _index():
+    index = {}
+    # При совпадении ключей побеждает более крупный город
+    for city in sorted(read_cities(), key=lambda city: city['population']):
+        for name in (city['name'], *city['aliases']): index[city_key(name)] = city['id']
+    return index
+
+
+def resolve(value):
+    """id города из справочника или None, если город не распознан."""
+    key = city_key(value)
+    return _index().get(key) if key else None
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle: value |= 1; bounds[0] = middle
+        else: bounds[1] = middle
+        even, bits = not even, bits + 1
+        if bits == 5: chars.append(BASE32[value]); bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_degrees(precision):
+    """Высота и ширина ячейки geohash в градусах."""
+    lon_bits = (5 * precision + 1) // 2
+    return 180.0 / 2 ** (5 * precision - lon_bits), 360.0 / 2 ** lon_bits
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Префиксы geohash, ячейки которых вместе накрывают круг радиуса radius_km."""
+    # Ширина ячейки в км уменьшается к полюсу — считаем по самому северному краю круга
+    edge = min(abs(latitude) + radius_km / KM_PER_DEGREE, 89.0)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_degrees(candidate)
+        if height * KM_PER_DEGREE >= radius_km and width * KM_PER_DEGREE * math.cos(math.radians(edge)) >= radius_km:
+            precision = candidate
+            break
+    height, width = cell_degrees(precision)
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            lat = max(-89.999999, min(89.999999, latitude + dlat))
+            lon = (longitude + dlon + 180) % 360 - 180
+            cells.add(geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cities_within(city_id, radius_km):
+    """id городов не дальше radius_km от города city_id (включая его самого)."""
+    from django.db.models import Q
+    from .models import City
+    center = City.objects.filter(id=city_id).values('latitude', 'longitude').first()
+    if center is None: return []
+    condition = Q()
+    for cell in covering_cells(center['latitude'], center['longitude'], radius_km): condition |= Q(geohash__startswith=cell)
+    candidates = City.objects.filter(condition).values_list('id', 'latitude', 'longitude')
+    return [city_id for city_id, latitude, longitude in candidates
+            if distance_km(center['latitude'], center['longitude'], latitude, longitude) <= radius_km]
+
+
+def load(City, UserProfile, batch_size=1000):
+    """Переносит справочник из файла в таблицу City и заново сопоставляет города анкет.
+    Принимает модели явно, чтобы работать и из миграции. Возвращает (городов, анкет изменено)."""
+    cities = [City(**{key: value for key, value in city.items() if key != 'aliases'}) for city in read_cities()]
+    City.objects.bulk_create(cities, update_conflicts=True, unique_fields=['id'],
+                             update_fields=['name', 'region', 'latitude', 'longitude', 'population', 'geohash'])
+    City.objects.exclude(id__in=[city.id for city in cities]).delete()
+    _index.cache_clear()
+    changed = []
+    for profile in UserProfile.objects.only('id', 'city', 'city_ref').iterator(chunk_size=batch_size):
+        city_id = resolve(profile.city)
+        if city_id != profile.city_ref_id:
+            profile.city_ref_id = city_id
+            changed.append(profile)
+    UserProfile.objects.bulk_update(changed, ['city_ref'], batch_size=batch_size)
+    return len(cities), len(changed)
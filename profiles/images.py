@@ -0,0 +1,88 @@
+import os
+from io import BytesIO
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from django.db import transaction
+from .lru import LRUCache
+from .models import UserProfile, Photo
+from .taskqueue import task
+from . import fragments
+
+# Размеры вариантов: card и avatar обрезаются точно под размер, full вписывается в рамку
+VARIANTS = {'card': (400, 425), 'avatar': (96, 110), 'full': (1280, 1280)}
+CROPPED = {'card', 'avatar'}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+# Готовый вариант не исчезает (кроме delete_images), поэтому "есть" кэшируется в процессе бессрочно.
+# "Нет" — в общем кэше на MISSING_TTL: generate_variants в воркере стирает эту отметку, как только вариант готов
+_existing = LRUCache(maxsize=20000)
+MISSING_TTL = 30
+DEFAULT_PHOTO = UserProfile._meta.get_field('photo').default   # заглушка, вариантов у нее нет
+
+
+def variant_name(name, variant, ext):
+    root, _ = os.path.splitext(name)
+    return f'variants/{root}.{variant}.{ext}'
+
+
+@task(retries=2, timeout=120)
+def generate_variants(name):
+    with default_storage.open(name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGB')
+    for variant, size in VARIANTS.items():
+        if variant in CROPPED:
+            resized = ImageOps.fit(image, size, Image.LANCZOS)
+        else:
+            resized = image.copy(); resized.thumbnail(size, Image.LANCZOS)
+        for ext, (pil_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            target = variant_name(name, variant, ext)
+            if default_storage.exists(target): default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    for variant in VARIANTS:
+        for ext in FORMATS: _forget(variant_name(name, variant, ext))
+    # Карточки и блоки анкеты, отрендеренные до генерации, хранят URL оригинала — сбрасываем их
+    user_ids = set(UserProfile.objects.filter(photo=name).values_list('user_id', flat=True))
+    user_ids.update(Photo.objects.filter(image=name).values_list('user_profile__user_id', flat=True))
+    for user_id in user_ids: transaction.on_commit(lambda user_id=user_id: fragments.invalidate(user_id))
+
+
+@task(retries=2, timeout=60)
+def delete_images(name):
+    """Удаляет из хранилища оригинал и все его варианты."""
+    for target in [name] + [variant_name(name, variant, ext) for variant in VARIANTS for ext in FORMATS]:
+        default_storage.delete(target)
+        _forget(target)
+
+
+def schedule_variants(field_file):
+    """Ставит генерацию вариантов в фоновую очередь — вне пути запроса."""
+    if not field_file or not field_file.name: return
+    generate_variants.enqueue(field_file.name, dedup_key=f'image-variants:{field_file.name}')
+
+
+def _missing_key(name):
+    return f'image-variant:missing:{name}'
+
+
+def _forget(name):
+    _existing.discard(name)
+    cache.delete(_missing_key(name))
+
+
+def variant_url(field_file, variant, ext='webp'):
+    """URL готового варианта; пока он не сгенерирован — URL оригинала."""
+    if not field_file or not field_file.name: return ''
+    if field_file.name == DEFAULT_PHOTO: return field_file.url
+    name = variant_name(field_file.name, variant, ext)
+    if not _existing.get(name):
+        if cache.get(_missing_key(name)): return field_file.url
+        if not default_storage.exists(name):
+            cache.set(_missing_key(name), True, MISSING_TTL)
+            return field_file.url
+        _existing.set(name, True)
+    return default_storage.url(name)
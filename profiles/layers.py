@@ -0,0 +1,171 @@
+"""
+Слои каналов для ChatConsumer и уведомлений (settings.CHANNEL_LAYERS).
+
+RedisChannelLayer — channels_redis с пакетной рассылкой в группы. group_send не ходит в Redis сам:
+события, отправленные в одной итерации цикла событий (или за batch_window), копятся и уходят вместе —
+одним конвейером (pipeline) за составом всех групп и одним Lua-скриптом на каждый сервер Redis.
+Вместо четырех обращений к Redis на событие выходит два на пачку. Событие кодируется в msgpack один
+раз: в копию для каждого ключа Redis (ключ — процесс-получатель) дописывается только список каналов.
+Формат сообщений прежний, поэтому receive() и send() — из channels_redis без изменений.
+
+InProcessChannelLayer — слой в памяти процесса для однопроцессного запуска (один воркер, локальная
+разработка, manage.py benchmark): событие копируется один раз, а не для каждого получателя.
+"""
+import asyncio
+import collections
+import logging
+import random
+import time
+from copy import deepcopy
+import msgpack
+from channels.layers import InMemoryChannelLayer
+from channels_redis import core
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_KEY = '__asgi_channel__'
+_CHANNEL_KEY_PACKED = msgpack.packb(CHANNEL_KEY)
+
+# Для каждого ключа: срок годности старых сообщений, проверка емкости, ZADD. ARGV — тройками
+# (сообщение, емкость, score) на каждый ключ, затем срок годности
+GROUP_SEND_LUA = """
+local expiry = tonumber(ARGV[#ARGV])
+local over_capacity = 0
+for i = 1, #KEYS do
+    local score = tonumber(ARGV[i * 3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], 0, score - expiry)
+    if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i * 3 - 1]) then
+        redis.call('ZADD', KEYS[i], score, ARGV[i * 3 - 2])
+        redis.call('EXPIRE', KEYS[i], expiry)
+    else
+        over_capacity = over_capacity + 1
+    end
+end
+return over_capacity
+"""
+
+
+def _map_header(size):
+    if size < 16: return bytes([0x80 | size])
+    if size < 2 ** 16: return b'\xde' + size.to_bytes(2, 'big')
+    return b'\xdf' + size.to_bytes(4, 'big')
+
+
+def with_channels(packed, size, channels):
+    """Дописывает CHANNEL_KEY в уже закодированный словарь из size ключей, не перекодируя его."""
+    return _map_header(size + 1) + packed[len(_map_header(size)):] + _CHANNEL_KEY_PACKED + msgpack.packb(channels)
+
+
+class _Batch:
+    __slots__ = ('events', 'task')
+
+    def __init__(self):
+        self.events = []   # (группа, закодированное событие, число ключей, future)
+        self.task = None
+
+
+class RedisChannelLayer(core.RedisChannelLayer):
+    """
+    channels_redis.core.RedisChannelLayer с пакетным group_send. Дополнительные параметры CONFIG:
+    batch_window — сколько секунд копить события (0 — до следующей итерации цикла событий),
+    batch_size — после скольких событий отправлять пачку, не дожидаясь окна.
+    """
+    def __init__(self, *args, batch_window=0.0, batch_size=100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._batches = {}     # цикл событий -> _Batch: соединения channels_redis тоже привязаны к циклу
+        self._last_score = 0.0
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert CHANNEL_KEY not in message
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(loop)
+        if batch is None: batch = self._batches[loop] = _Batch()
+        future = loop.create_future()
+        batch.events.append((group, msgpack.packb(message, use_bin_type=True), len(message), future))
+        if len(batch.events) >= self.batch_size:
+            # Пачка набрана: отправляем сразу, следующие события копятся в новой
+            del self._batches[loop]
+            if batch.task is not None: batch.task.cancel()
+            loop.create_task(self._send_batch(batch.events))
+        elif batch.task is None:
+            batch.task = loop.create_task(self._flush_later(loop, batch))
+        # Ждем отправки, как и обычный group_send: ошибки Redis получит вызывающий
+        await future
+
+    async def _flush_later(self, loop, batch):
+        await asyncio.sleep(self.batch_window)
+        if self._batches.get(loop) is batch: del self._batches[loop]
+        await self._send_batch(batch.events)
+
+    async def _send_batch(self, events):
+        try:
+            await self._deliver(events)
+        except Exception as error:
+            for *_, future in events:
+                if not future.done(): future.set_exception(error)
+        else:
+            for *_, future in events:
+                if not future.done(): future.set_result(None)
+
+    def _score(self):
+        # Сообщения одного скрипта получают разные возрастающие score: при равных ZSET упорядочил бы
+        # их по случайному префиксу, и порядок событий в канале перемешался бы
+        self._last_score = max(time.time(), self._last_score + 1e-6)
+        return self._last_score
+
+    async def _members(self, groups):
+        """{группа: [каналы]} — по одному конвейеру на сервер Redis, где лежат группы."""
+        by_index = collections.defaultdict(list)
+        for group in groups: by_index[self.consistent_hash(group)].append(group)
+        members, cutoff = {}, int(time.time()) - self.group_expiry
+        for index, shard_groups in by_index.items():
+            pipe = self.connection(index).pipeline(transaction=False)
+            for group in shard_groups:
+                key = self._group_key(group)
+                pipe.zremrangebyscore(key, min=0, max=cutoff)
+                pipe.zrange(key, 0, -1)
+            replies = await pipe.execute()
+            for group, names in zip(shard_groups, replies[1::2]):
+                members[group] = [name.decode('utf8') for name in names]
+        return members
+
+    async def _deliver(self, events):
+        members = await self._members({group for group, *_ in events})
+        # Сервер Redis -> тройки (ключ, сообщение, емкость) в порядке событий
+        deliveries = collections.defaultdict(list)
+        for group, packed, size, _ in events:
+            by_key = {}
+            for channel in members[group]:
+                by_key.setdefault(self.prefix + self.non_local_name(channel), []).append(channel)
+            for key, channels in by_key.items():
+                body = with_channels(packed, size, channels)
+                if self.crypter: body = self.crypter.encrypt(body)
+                message = random.getrandbits(8 * 12).to_bytes(12, 'big') + body
+                deliveries[self.consistent_hash(self.non_local_name(channels[0]))].append((key, message, self.get_capacity(channels[0])))
+        for index, items in deliveries.items():
+            args = []
+            for _, message, capacity in items: args += [message, capacity, self._score()]
+            over_capacity = await self.connection(index).eval(GROUP_SEND_LUA, len(items), *(key for key, *_ in items), *args, self.expiry)
+            if over_capacity:
+                logger.info('%s из %s сообщений пачки не доставлены: каналы переполнены', over_capacity, len(items))
+
+
+class InProcessChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer, который при рассылке в группу копирует событие один раз, а получателям
+    раздает поверхностные копии. Обработчики событий не должны менять вложенные значения.
+    """
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        self._clean_expired()
+        message, expires = deepcopy(message), time.time() + self.expiry
+        for channel in list(self.groups.get(group, {})):
+            queue = self.channels.setdefault(channel, asyncio.Queue())
+            # Переполненный канал пропускается, как и в InMemoryChannelLayer
+            if queue.qsize() >= self.capacity: continue
+            queue.put_nowait((expires, dict(message)))
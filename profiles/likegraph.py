@@ -0,0 +1,175 @@
+"""
+Кандидаты во взаимную симпатию по графу лайков (коллаборативная фильтрация, manage.py build_candidates).
+
+Граф Like целиком загружается в массивы NumPy в формате CSR: у каждого пользователя — срез исходящих
+лайков (кого лайкнул) и срез входящих (кто лайкнул его). Для пользователя u:
+  1. похожие — те, кто лайкал те же анкеты, что и u; общая анкета весит тем меньше, чем она популярнее;
+  2. интерес u к кандидату c — сумма весов похожих, которые лайкнули c;
+  3. интерес c к u — сумма весов похожих, которых лайкнул c: c отвечает симпатией людям со вкусом u;
+  4. оценка — среднее гармоническое обеих сторон, поэтому высоко стоят только пары, где интерес
+     ожидается взаимным.
+Пользователи считаются кусками в пуле процессов; top-K каждого записывается в LikeCandidate.
+"""
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from django.db import connections, transaction
+from .matching import CODES
+from .models import UserProfile, Like, LikeCandidate
+from . import bulk
+
+TOP_K = 50
+MAX_FANOUT = 1000    # соседей, которые берутся из одного среза: популярная анкета не раздувает обход
+MAX_SIMILAR = 300    # похожих пользователей, по которым ищутся кандидаты
+LOAD_BATCH_SIZE = 100000
+
+_EMPTY = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+
+
+def _csr(rows, cols, size):
+    """(indptr, indices) для ребер rows -> cols. Внутри строки ребра остаются в исходном порядке (по id Like)."""
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, cols[np.argsort(rows, kind='stable')].astype(np.int32)
+
+
+def _gather(indptr, indices, rows, limit=MAX_FANOUT):
+    """Соседи строк rows одним массивом (не больше limit последних на строку) и позиция в rows, откуда пришел каждый."""
+    ends = indptr[rows + 1]
+    starts = np.maximum(indptr[rows], ends - limit)
+    lengths = ends - starts
+    origin = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(len(origin)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return indices[positions], origin
+
+
+def _accumulate(ids, weights):
+    """(уникальные ids, сумма весов по каждому)."""
+    unique, inverse = np.unique(ids, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights)
+
+
+class LikeGraph:
+    """Граф лайков в массивах: строка — пользователь (user_ids отсортированы), indices — int32."""
+    def __init__(self, user_ids, src, dst, genders):
+        size = len(user_ids)
+        self.user_ids, self.genders = user_ids, genders
+        self.out_ptr, self.out_idx = _csr(src, dst, size)
+        self.in_ptr, self.in_idx = _csr(dst, src, size)
+        self.weight = (1 / np.log2(2 + np.diff(self.in_ptr))).astype(np.float32)
+
+    @classmethod
+    def load(cls, batch_size=LOAD_BATCH_SIZE):
+        # Пары id держим компактно (array, 8 байт на id), а не списком кортежей
+        src, dst = array('q'), array('q')
+        for user_from, user_to in Like.objects.order_by('id').values_list('user_from_id', 'user_to_id').iterator(chunk_size=batch_size):
+            src.append(user_from); dst.append(user_to)
+        src, dst = np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64)
+        user_ids, rows = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        # Пол: -1 — анкеты нет, такой пользователь кандидатом не станет
+        profile_ids, codes = array('q'), array('b')
+        for user_id, gender in UserProfile.objects.values_list('user_id', 'gender').iterator(chunk_size=batch_size):
+            profile_ids.append(user_id); codes.append(CODES['gender'].get(gender, -1))
+        profile_ids, codes = np.array(profile_ids, dtype=np.int64), np.array(codes, dtype=np.int8)
+        genders = np.full(len(user_ids), -1, dtype=np.int8)
+        if len(user_ids):
+            positions = np.minimum(np.searchsorted(user_ids, profile_ids), len(user_ids) - 1)
+            found = user_ids[positions] == profile_ids
+            genders[positions[found]] = codes[found]
+        return cls(user_ids, rows[:len(src)], rows[len(src):], genders)
+
+    @property
+    def likes(self): return len(self.out_idx)
+
+    def active_rows(self):
+        """Строки пользователей, которые сами кого-то лайкнули: только для них есть по чему считать."""
+        return np.flatnonzero(np.diff(self.out_ptr))
+
+    def candidates(self, row, k=TOP_K):
+        """(строки кандидатов, оценки) для строки row по убыванию оценки, не больше k."""
+        gender = self.genders[row]
+        liked = self.out_idx[self.out_ptr[row]:self.out_ptr[row + 1]]
+        if gender < 0 or not len(liked): return _EMPTY
+        co_likers, origin = _gather(self.in_ptr, self.in_idx, liked)
+        similar, weight = _accumulate(co_likers, self.weight[liked][origin])
+        keep = similar != row
+        similar, weight = similar[keep], weight[keep]
+        if len(similar) > MAX_SIMILAR:
+            top = np.argpartition(-weight, MAX_SIMILAR)[:MAX_SIMILAR]
+            similar, weight = similar[top], weight[top]
+        if not len(similar): return _EMPTY
+
+        wanted, origin = _gather(self.out_ptr, self.out_idx, similar)
+        admirers, reply_origin = _gather(self.in_ptr, self.in_idx, similar)
+        if not len(wanted) or not len(admirers): return _EMPTY
+        wanted, interest = _accumulate(wanted, weight[origin])
+        admirers, reply = _accumulate(admirers, weight[reply_origin])
+        common, a, b = np.intersect1d(wanted, admirers, assume_unique=True, return_indices=True)
+        interest, reply = interest[a] / interest.max(), reply[b] / reply.max()
+        # Кто уже лайкнул u, ответит почти наверняка
+        reply[np.isin(common, self.in_idx[self.in_ptr[row]:self.in_ptr[row + 1]])] = 1.0
+
+        candidate_genders = self.genders[common]
+        mask = (common != row) & (candidate_genders >= 0) & (candidate_genders != gender) & ~np.isin(common, liked)
+        common, interest, reply = common[mask], interest[mask], reply[mask]
+        score = (2 * interest * reply / (interest + reply)).astype(np.float32)
+        if len(common) > k:
+            top = np.argpartition(-score, k)[:k]
+            common, score = common[top], score[top]
+        order = np.argsort(-score, kind='stable')
+        return common[order], score[order]
+
+    def top_k(self, rows, k=TOP_K):
+        """Для строк rows: (владельцы, кандидаты, места, оценки) — плоские массивы, места с нуля."""
+        owners, candidates, ranks, scores = [], [], [], []
+        for row in rows:
+            found, score = self.candidates(row, k)
+            owners.append(np.full(len(found), row, dtype=np.int32)); candidates.append(found)
+            ranks.append(np.arange(len(found), dtype=np.int16)); scores.append(score)
+        if not owners: return tuple(np.empty(0, dtype=dtype) for dtype in (np.int32, np.int32, np.int16, np.float32))
+        return np.concatenate(owners), np.concatenate(candidates), np.concatenate(ranks), np.concatenate(scores)
+
+
+_graph = None   # граф в процессе пула
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def _score_chunk(rows, k):
+    return rows, _graph.top_k(rows, k)
+
+
+def build(graph, k=TOP_K, workers=1, chunk_size=1000):
+    """Генератор (строки куска, результат top_k) по всем активным пользователям графа."""
+    rows = graph.active_rows()
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for chunk in chunks: yield chunk, graph.top_k(chunk, k)
+        return
+    # fork, а не spawn (как в run_tasks): массивы графа достаются процессам без копирования и
+    # сериализации. Соединения с БД закрываются заранее, чтобы процессы пула их не унаследовали
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker, initargs=(graph,)) as executor:
+        # Впереди не больше двух кусков на процесс: результаты не копятся, пока идет запись в БД
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_score_chunk, chunk, k))
+            if len(pending) >= 2 * workers: yield pending.popleft().result()
+        while pending: yield pending.popleft().result()
+
+
+def store(graph, rows, result, computed_at):
+    """Заменяет кандидатов пользователей rows результатом top_k; возвращает число записанных строк."""
+    owners, candidates, ranks, scores = result
+    user_ids = graph.user_ids
+    objs = [LikeCandidate(user_id=user_id, candidate_id=candidate_id, rank=rank, score=score, computed_at=computed_at)
+            for user_id, candidate_id, rank, score in zip(user_ids[owners].tolist(), user_ids[candidates].tolist(), ranks.tolist(), scores.tolist())]
+    with transaction.atomic():
+        LikeCandidate.objects.filter(user_id__in=user_ids[rows].tolist()).delete()
+        return bulk.insert_objects(LikeCandidate, objs)
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from profiles import archive
+from profiles.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые сообщения чата из таблицы Message в сжатый архив диалогов (profiles/archive.py). Запускать в одном экземпляре.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS, help='Архивировать сообщения старше стольких дней')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Сообщений диалога за один проход')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не переносить')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size, dry_run = options['batch_size'], options['dry_run']
+        archived = conversations = skipped = 0
+        for low, high in Conversation.objects.order_by('id').values_list('user_low_id', 'user_high_id').iterator(chunk_size=2000):
+            moved, left = self.archive_pair(low, high, cutoff, batch_size, dry_run)
+            archived += moved; skipped += left
+            if moved: conversations += 1
+        if not dry_run: self.restore_last_messages()
+        verb = 'Будет перенесено' if dry_run else 'Перенесено в архив'
+        self.stdout.write(self.style.SUCCESS(f'{verb} сообщений: {archived} из {conversations} диалогов.'))
+        if skipped: self.stdout.write(f'Оставлено в БД (старше архива, но не в нем): {skipped}')
+
+    def archive_pair(self, low, high, cutoff, batch_size, dry_run):
+        newest = Message.between(low, high).order_by('-id').values_list('id', flat=True).first()
+        if newest is None: return 0, 0
+        # Последнее сообщение диалога остается в БД: на него указывает Conversation.last_message,
+        # а mark_read не пускает водяной знак дальше него. В архив оно уйдет, когда появятся новые
+        old = Message.between(low, high).filter(timestamp__lt=cutoff, id__lt=newest).order_by('id')
+        moved = left = after = 0
+        while True:
+            rows = list(old.filter(id__gt=after).values('id', 'sender_id', 'receiver_id', 'content', 'timestamp', 'is_read')[:batch_size])
+            if not rows: return moved, left
+            after = rows[-1]['id']
+            last_id = archive.last_archived_id(low, high)
+            fresh = [row for row in rows if row['id'] > last_id]
+            stale_ids = [row['id'] for row in rows if row['id'] <= last_id]
+            done_ids = [row['id'] for row in fresh]
+            if stale_ids:
+                # Строки, уже попавшие в архив (прошлый запуск упал до удаления), просто удаляем;
+                # более старые, но не заархивированные остаются в БД, чтобы id в архиве только росли
+                with archive.Segment(low, high) as segment:
+                    in_archive = segment.ids_between(stale_ids[0], stale_ids[-1])
+                done_ids += [message_id for message_id in stale_ids if message_id in in_archive]
+                left += sum(1 for message_id in stale_ids if message_id not in in_archive)
+            moved += len(done_ids)
+            if dry_run: continue
+            if fresh: archive.append(low, high, fresh)
+            with transaction.atomic():
+                Message.objects.filter(id__in=done_ids).delete()
+
+    def restore_last_messages(self):
+        # Диалоги, у которых прежние запуски заархивировали last_message (ON DELETE SET NULL),
+        # снова указывают на последнее оставшееся в БД сообщение
+        newest = (Message.objects.filter(Q(sender_id=OuterRef('user_low_id'), receiver_id=OuterRef('user_high_id'))
+                                         | Q(sender_id=OuterRef('user_high_id'), receiver_id=OuterRef('user_low_id')))
+                  .order_by('-id').values('id')[:1])
+        Conversation.objects.filter(last_message__isnull=True).update(last_message_id=Subquery(newest))
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from profiles import benchmark
+
+BASELINE_FILE = Path(settings.BASE_DIR) / 'benchmark_baselines.json'
+
+
+class Command(BaseCommand):
+    help = ('Замеры latency (p50/p95/p99), числа запросов и пропускной способности основных страниц и ChatConsumer '
+            'на синтетических данных в отдельной тестовой БД. Падает, если результат хуже эталона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(benchmark.SCALES), default='small')
+        parser.add_argument('--iterations', type=int, default=50, help='Запросов на сценарий')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baseline', default=str(BASELINE_FILE), help='JSON с эталонными результатами')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Допустимое ухудшение p95 относительно эталона (0.5 = +50%%)')
+        parser.add_argument('--update-baseline', action='store_true', help='Записать результаты прогона как новый эталон')
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        setup_test_environment()
+        # БД каждый раз новая: сценарий чата дописывает сообщения, и повторный прогон на старой был бы уже не тем же замером
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            # Кэш и слой каналов — в памяти процесса, фоновые задачи — сразу, чтобы замер не зависел от Redis и воркера.
+            # Тестовый клиент ходит по HTTP: при DEBUG=False редирект на HTTPS отвечал бы 301 на каждый запрос,
+            # а манифест статики есть только после collectstatic — имена статики берутся как при DEBUG=True
+            with override_settings(CACHES={alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+                                           for alias in ('default', 'fragments')},
+                                   CHANNEL_LAYERS={'default': {'BACKEND': 'profiles.layers.InProcessChannelLayer'}}, TASKS_EAGER=True,
+                                   SECURE_SSL_REDIRECT=False, STORAGES={**settings.STORAGES, 'staticfiles': {
+                                       'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}):
+                self.stdout.write(f'Заполнение БД ({scale}: {benchmark.SCALES[scale]})...')
+                main_id = benchmark.seed(benchmark.SCALES[scale], options['seed'])
+                results = benchmark.run_views(main_id, options['iterations'])
+                results['chat_consumer'] = benchmark.run_chat(main_id, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        path = Path(options['baseline'])
+        baselines = json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+        if options['update_baseline']:
+            baselines[scale] = results
+            path.write_text(json.dumps(baselines, ensure_ascii=False, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f'Эталон для {scale} записан в {path}'))
+            return
+        if scale not in baselines:
+            self.stdout.write(self.style.WARNING(f'Эталона для {scale} нет — сравнивать не с чем.'))
+            return
+        failures = benchmark.compare(results, baselines[scale], options['tolerance'])
+        if failures: raise CommandError('Регрессия производительности:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Результаты в пределах эталона.'))
+
+    def report(self, results):
+        self.stdout.write(f'{"сценарий":<24}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}{"запросов":>10}{"запр/с":>10}')
+        for name, row in results.items():
+            queries = '-' if row['queries'] is None else row['queries']
+            self.stdout.write(f'{name:<24}{row["p50_ms"]:>10}{row["p95_ms"]:>10}{row["p99_ms"]:>10}{queries:>10}{row["rps"]:>10}')
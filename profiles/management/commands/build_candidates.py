@@ -0,0 +1,33 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from profiles import likegraph
+from profiles.models import LikeCandidate
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает кандидатов во взаимную симпатию по графу лайков (LikeCandidate). Запускать по ночам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=likegraph.TOP_K, help='Кандидатов на пользователя')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов для расчета (1 — без пула)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Пользователей в одном куске расчета и в одной транзакции записи')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не записывать')
+
+    def handle(self, *args, **options):
+        started, clock = timezone.now(), time.monotonic()
+        graph = likegraph.LikeGraph.load()
+        self.stdout.write(f'Граф загружен за {time.monotonic() - clock:.1f} с: пользователей {len(graph.user_ids)}, симпатий {graph.likes}.')
+        users = written = 0
+        for rows, result in likegraph.build(graph, k=options['top_k'], workers=options['workers'], chunk_size=options['chunk_size']):
+            users += len(rows)
+            if options['dry_run']: written += len(result[0])
+            else: written += likegraph.store(graph, rows, result, started)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Будет записано кандидатов: {written} для {users} пользователей.'))
+            return
+        # Кандидаты тех, кого не было в этом пересчете (удалили свои лайки или аккаунт), устарели
+        stale = LikeCandidate.objects.filter(computed_at__lt=started).delete()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано кандидатов: {written} для {users} пользователей за {time.monotonic() - clock:.1f} с, удалено устаревших: {stale}.'))
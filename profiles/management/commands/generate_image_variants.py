@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from profiles.images import generate_variants
+from profiles.models import UserProfile, Photo
+
+
+class Command(BaseCommand):
+    help = 'Генерирует уменьшенные варианты (card, avatar, full) для уже загруженных фотографий.'
+
+    def handle(self, *args, **options):
+        names = set(UserProfile.objects.values_list('photo', flat=True)) | set(Photo.objects.values_list('image', flat=True))
+        done = failed = 0
+        for name in sorted(filter(None, names)):
+            try:
+                generate_variants(name); done += 1
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'{name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Готово: {done}, с ошибками: {failed}.'))
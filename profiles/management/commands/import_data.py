@@ -0,0 +1,287 @@
+import random
+from array import array
+import time
+from datetime import date, timedelta
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from profiles import bulk, fulltext, gazetteer
+from profiles.lru import LRUCache
+from profiles.models import UserProfile, Like, Message, Notification, normalize_city
+
+KINDS = ('users', 'likes', 'messages', 'notifications')
+PROFILE_FIELDS = [field.name for field in UserProfile._meta.concrete_fields if field.name not in ('id', 'user', 'city_normalized', 'city_ref', 'photo', 'updated_at')]
+CITIES = ('Москва', 'Санкт-Петербург', 'Екатеринбург', 'Казань', 'Нижний Новгород', 'Самара', 'Сергиев Посад', 'Псков', 'Тверь', 'Ярославль')
+
+
+class Command(BaseCommand):
+    help = (
+        'Массовая загрузка пользователей с анкетами, симпатий, сообщений и уведомлений из CSV/JSONL '
+        'или генерация синтетических данных. Строки пишутся пачками (COPY на PostgreSQL), '
+        'после загрузки пересчитываются взаимные симпатии и сводки диалогов.\n'
+        'Поля: users — username, password (пароль) или password_hash (готовый хэш Django), first_name, last_name, email и поля анкеты; '
+        'likes — user_from, user_to; messages — sender, receiver, content, timestamp, is_read; '
+        'notifications — recipient, sender, notification_type, message, count, is_read, created_at '
+        '(пользователи указываются по username).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS + ('synthetic',))
+        parser.add_argument('file', nargs='?', help='CSV с заголовком или JSONL (для synthetic не нужен)')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию — по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='password', help='Пароль пользователей, у которых он не указан')
+        parser.add_argument('--users', type=int, default=10000, help='synthetic: число пользователей')
+        parser.add_argument('--likes-per-user', type=int, default=20, help='synthetic')
+        parser.add_argument('--messages-per-user', type=int, default=50, help='synthetic')
+        parser.add_argument('--notifications-per-user', type=int, default=10, help='synthetic')
+        parser.add_argument('--seed', type=int, default=42, help='synthetic: зерно генератора')
+        parser.add_argument('--prefix', default='seed', help='synthetic: префикс логинов')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.default_hash = make_password(options['password'])
+        self.hashes = LRUCache(1000)  # одинаковые пароли в файле хэшируются один раз
+        self.skipped = 0
+        if options['kind'] == 'synthetic':
+            self.synthetic(options)
+        else:
+            if not options['file']: raise CommandError('Укажите файл с данными.')
+            records = bulk.read_records(options['file'], options['format'])
+            getattr(self, f'import_{options["kind"]}')(records)
+            if options['kind'] == 'users': fulltext.rebuild()
+            if options['kind'] == 'likes': self.finish_likes()
+            if options['kind'] == 'messages': self.finish_messages()
+        if self.skipped: self.stdout.write(self.style.WARNING(f'Пропущено записей с неизвестными пользователями: {self.skipped}'))
+        self.stdout.write('Закэшированные счетчики бейджей устарели: запустите manage.py reconcile_counters.')
+
+    # --- загрузка из файла ---
+
+    def import_users(self, records):
+        with self.progress('пользователей') as report:
+            for batch in bulk.batched(records, self.batch_size):
+                report(self.insert_users(batch))
+
+    def insert_users(self, batch):
+        bulk.insert_objects(User, [User(
+            username=record['username'], password=self.password_hash(record.get('password'), record.get('password_hash')), email=record.get('email', ''),
+            first_name=record.get('first_name', ''), last_name=record.get('last_name', ''),
+            **({'date_joined': self.when(record['date_joined'])} if record.get('date_joined') else {}),
+        ) for record in batch])
+        ids = self.resolve(record['username'] for record in batch)
+        profiles = []
+        for record in batch:
+            values = {field: record[field] for field in PROFILE_FIELDS if field in record}
+            values['date_of_birth'] = parse_date(values['date_of_birth']) if isinstance(values.get('date_of_birth'), str) else values.get('date_of_birth')
+            for field in ('marital_status', 'children', 'churching_level', 'attitude_to_fasting', 'sacraments'):
+                values.setdefault(field, UserProfile._meta.get_field(field).choices[0][0])
+            profiles.append(UserProfile(user_id=ids[record['username']], city_normalized=normalize_city(values.get('city', '')),
+                                        city_ref_id=gazetteer.resolve(values.get('city')), **values))
+        bulk.insert_objects(UserProfile, profiles)
+        return len(batch)
+
+    def import_likes(self, records):
+        with self.progress('симпатий') as report:
+            for batch in bulk.batched(records, self.batch_size):
+                ids = self.resolve(name for record in batch for name in (record['user_from'], record['user_to']))
+                report(bulk.insert_objects(Like, [
+                    Like(user_from_id=ids[record['user_from']], user_to_id=ids[record['user_to']], created_at=self.when(record.get('created_at')))
+                    for record in self.known(batch, ids, 'user_from', 'user_to')
+                ]))
+
+    def import_messages(self, records):
+        with self.progress('сообщений') as report:
+            for batch in bulk.batched(records, self.batch_size):
+                ids = self.resolve(name for record in batch for name in (record['sender'], record['receiver']))
+                report(bulk.insert_objects(Message, [
+                    Message(sender_id=ids[record['sender']], receiver_id=ids[record['receiver']], content=record['content'],
+                            timestamp=self.when(record.get('timestamp')), is_read=self.flag(record.get('is_read')))
+                    for record in self.known(batch, ids, 'sender', 'receiver')
+                ]))
+
+    def import_notifications(self, records):
+        # Непрочитанные сливаются по группам (см. Notification.record): сначала внутри пачки, затем
+        # с непрочитанными строками в БД — там же и группы из прежних пачек. Память — на одну пачку
+        with self.progress('уведомлений') as report:
+            for batch in bulk.batched(records, self.batch_size):
+                ids = self.resolve(name for record in batch for name in (record['recipient'], record.get('sender')) if name)
+                notifications, unread = [], {}
+                for record in self.known(batch, ids, 'recipient'):
+                    notification = Notification(
+                        recipient_id=ids[record['recipient']], sender_id=ids.get(record.get('sender')), message=record['message'],
+                        notification_type=record['notification_type'], count=int(record.get('count') or 1), is_read=self.flag(record.get('is_read')),
+                        created_at=self.when(record.get('created_at')) or timezone.now())
+                    notification.group_key = Notification.group_key_for(notification.notification_type, notification.sender_id)
+                    if notification.is_read: notifications.append(notification); continue
+                    key = (notification.recipient_id, notification.notification_type, notification.group_key)
+                    merged = unread.get(key)
+                    if merged is None: unread[key] = notification
+                    # Остается самое новое событие группы, счетчики складываются
+                    elif notification.created_at >= merged.created_at: notification.count += merged.count; unread[key] = notification
+                    else: merged.count += notification.count
+                with transaction.atomic():
+                    report(bulk.insert_objects(Notification, notifications) + self.merge_unread(list(unread.values())))
+
+    def merge_unread(self, batch):
+        """Вставляет непрочитанные уведомления пачки; группы, у которых в БД уже есть непрочитанная строка, сливаются с ней."""
+        if not batch: return 0
+        with transaction.atomic():
+            existing = {(n.recipient_id, n.notification_type, n.group_key): n for n in Notification.objects.select_for_update().filter(
+                recipient_id__in={n.recipient_id for n in batch}, is_read=False)}
+            merged, new = [], []
+            for notification in batch:
+                current = existing.get((notification.recipient_id, notification.notification_type, notification.group_key))
+                if current is None: new.append(notification); continue
+                current.count += notification.count
+                if notification.created_at >= current.created_at:
+                    current.sender_id, current.message, current.created_at = notification.sender_id, notification.message, notification.created_at
+                merged.append(current)
+            Notification.objects.bulk_update(merged, ['count', 'sender', 'message', 'created_at'], batch_size=self.batch_size)
+            return bulk.insert_objects(Notification, new) + len(merged)
+
+    # --- синтетические данные ---
+
+    def synthetic(self, options):
+        rng, prefix, total = random.Random(options['seed']), options['prefix'], options['users']
+        now = timezone.now()
+        with self.progress('пользователей') as report:
+            for start in range(0, total, self.batch_size):
+                report(self.insert_users([{
+                    'username': f'{prefix}{i}', 'first_name': f'Имя{i}', 'gender': 'Мужчина' if i % 2 == 0 else 'Женщина',
+                    'date_of_birth': date(1965, 1, 1) + timedelta(days=rng.randrange(365 * 40)), 'city': rng.choice(CITIES),
+                    'height': rng.randrange(150, 200), 'about_me': f'Анкета {i}. ' * rng.randrange(1, 8),
+                    **{field: rng.choice(UserProfile._meta.get_field(field).choices)[0]
+                       for field in ('marital_status', 'children', 'churching_level', 'attitude_to_fasting', 'sacraments')},
+                } for i in range(start, min(start + self.batch_size, total))]))
+        fulltext.rebuild()  # анкеты вставлены в обход сигналов, обновляющих поисковый индекс
+        # id пользователей держим компактно (array, 8 байт на id), а не списком объектов
+        generated = UserProfile.objects.filter(user__username__startswith=prefix).order_by('user_id').values_list('user_id', 'gender')
+        ids, men, women, is_man = array('q'), array('q'), array('q'), bytearray()
+        for user_id, gender in generated.iterator(chunk_size=self.batch_size):
+            ids.append(user_id); is_man.append(gender == 'Мужчина')
+            (men if gender == 'Мужчина' else women).append(user_id)
+        if not men or not women: return
+
+        def partners(i):
+            return women if is_man[i] else men
+
+        with self.progress('симпатий') as report:
+            for batch in bulk.batched(range(len(ids)), max(1, self.batch_size // max(1, options['likes_per_user']))):
+                likes = []
+                for i in batch:
+                    others = partners(i)
+                    targets = {int(others[rng.randrange(len(others))]) for _ in range(options['likes_per_user'])}
+                    likes.extend(Like(user_from_id=int(ids[i]), user_to_id=target, created_at=now - timedelta(minutes=rng.randrange(525600))) for target in targets)
+                report(bulk.insert_objects(Like, likes))
+        self.finish_likes()
+
+        per_partner = 10  # сообщения идут сериями по per_partner в одном диалоге
+        with self.progress('сообщений') as report:
+            for batch in bulk.batched(range(len(ids)), max(1, self.batch_size // max(1, options['messages_per_user']))):
+                messages = []
+                for i in batch:
+                    others = partners(i)
+                    for _ in range(options['messages_per_user'] // per_partner):
+                        me, other = int(ids[i]), int(others[rng.randrange(len(others))])
+                        started = now - timedelta(minutes=rng.randrange(525600))
+                        messages.extend(Message(sender_id=me if n % 2 == 0 else other, receiver_id=other if n % 2 == 0 else me,
+                                                content=f'Сообщение {n}', timestamp=started + timedelta(minutes=n), is_read=True)
+                                        for n in range(per_partner))
+                report(bulk.insert_objects(Message, messages))
+        self.finish_messages()
+
+        with self.progress('уведомлений') as report:
+            for batch in bulk.batched(range(len(ids)), max(1, self.batch_size // max(1, options['notifications_per_user']))):
+                notifications = []
+                for i in batch:
+                    # Около 80% прочитаны; непрочитанные симпатии слиты в одну строку со счетчиком
+                    unread = sum(rng.random() >= 0.8 for _ in range(options['notifications_per_user']))
+                    notifications.extend(
+                        Notification(recipient_id=int(ids[i]), sender_id=int(ids[rng.randrange(len(ids))]), message='Новая симпатия',
+                                     notification_type='LIKE', is_read=True, created_at=now - timedelta(minutes=rng.randrange(525600)))
+                        for _ in range(options['notifications_per_user'] - unread))
+                    if unread:
+                        notifications.append(Notification(recipient_id=int(ids[i]), sender_id=int(ids[rng.randrange(len(ids))]), message='Новая симпатия',
+                                                          notification_type='LIKE', count=unread, created_at=now - timedelta(minutes=rng.randrange(60))))
+                report(bulk.insert_objects(Notification, notifications))
+
+    # --- общее ---
+
+    def finish_likes(self):
+        started = time.monotonic()
+        self.stdout.write(f'Взаимных симпатий: {bulk.rebuild_matches(self.batch_size)} ({time.monotonic() - started:.1f} с)')
+
+    def finish_messages(self):
+        started = time.monotonic()
+        self.stdout.write(f'Сводок диалогов пересчитано: {bulk.rebuild_conversations(self.batch_size)} ({time.monotonic() - started:.1f} с)')
+
+    def progress(self, noun):
+        return Progress(self.stdout, noun)
+
+    def resolve(self, usernames):
+        return dict(User.objects.filter(username__in=set(usernames)).values_list('username', 'id'))
+
+    def known(self, batch, ids, *keys):
+        for record in batch:
+            if all(record.get(key) in ids for key in keys): yield record
+            else: self.skipped += 1
+
+    def password_hash(self, raw, hashed=None):
+        """
+        Хэш для User.password. Готовый хэш из password_hash пишется как есть: PBKDF2 на строку не успеть.
+        password — всегда пароль и всегда хэшируется: угадывать хэш по виду нельзя, "!secret1" тоже пароль.
+        """
+        if hashed:
+            if not self.is_hash(hashed): raise CommandError('В password_hash должен быть хэш Django (алгоритм$...), а не пароль.')
+            return hashed
+        if raw is None: return self.default_hash
+        hashed = self.hashes.get(raw)
+        if hashed is None: hashed = make_password(raw); self.hashes.set(raw, hashed)
+        return hashed
+
+    @staticmethod
+    def is_hash(value):
+        if value.startswith(UNUSABLE_PASSWORD_PREFIX): return True
+        try: identify_hasher(value)
+        except ValueError: return False
+        return True
+
+    @staticmethod
+    def when(value):
+        if value is None or not isinstance(value, str): return value
+        parsed = parse_datetime(value)
+        if parsed is None: raise CommandError(f'Неверная дата: {value}')
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    @staticmethod
+    def flag(value):
+        if isinstance(value, str): return value.lower() in ('1', 'true', 'yes', 'да')
+        return bool(value)
+
+
+class Progress:
+    """Печатает число загруженных строк и скорость не чаще раза в INTERVAL секунд."""
+    INTERVAL = 5
+
+    def __init__(self, stdout, noun):
+        self.stdout, self.noun = stdout, noun
+
+    def __enter__(self):
+        self.total, self.started = 0, time.monotonic()
+        self.last = self.started
+        return self.report
+
+    def report(self, count):
+        self.total += count
+        if time.monotonic() - self.last >= self.INTERVAL:
+            self.last = time.monotonic()
+            self.stdout.write(f'  {self.noun}: {self.total} ({self.rate():.0f}/с)')
+
+    def rate(self):
+        return self.total / max(time.monotonic() - self.started, 1e-9)
+
+    def __exit__(self, *exc):
+        if exc[0] is None: self.stdout.write(f'Загружено {self.noun}: {self.total} за {time.monotonic() - self.started:.1f} с ({self.rate():.0f}/с)')
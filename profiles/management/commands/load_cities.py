@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from profiles import gazetteer
+from profiles.models import City, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Загружает справочник городов из profiles/data/cities.csv и заново сопоставляет города анкет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cities, changed = gazetteer.load(City, UserProfile, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Городов в справочнике: {cities}, анкет с обновленным городом: {changed}'))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from profiles.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Удаляет прочитанные уведомления старше N дней пачками, чтобы таблица не росла бесконечно. Запускать по расписанию.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.NOTIFICATION_RETENTION_DAYS, help='Удалять прочитанные уведомления старше стольких дней')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк за один DELETE')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        old = Notification.objects.filter(is_read=True, created_at__lt=timezone.now() - timedelta(days=options['days']))
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Будет удалено уведомлений: {old.count()}.'))
+            return
+        # Короткие DELETE по id, а не один на всю выборку: блокировки и журнал не раздуваются
+        deleted = 0
+        while True:
+            ids = list(old.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids: break
+            deleted += Notification.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Удалено уведомлений: {deleted}.'))
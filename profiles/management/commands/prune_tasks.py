@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from profiles.models import Task
+
+
+class Command(BaseCommand):
+    help = 'Удаляет завершенные (DONE и FAILED) фоновые задачи старше N дней пачками, чтобы таблица Task не росла бесконечно. Запускать по расписанию.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TASK_RETENTION_DAYS, help='Удалять задачи, завершенные раньше стольких дней назад')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк за один DELETE')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        old = Task.objects.filter(status__in=[Task.DONE, Task.FAILED], finished_at__lt=timezone.now() - timedelta(days=options['days']))
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Будет удалено задач: {old.count()}.'))
+            return
+        # Короткие DELETE по id, а не один на всю выборку: блокировки и журнал не раздуваются
+        deleted = 0
+        while True:
+            ids = list(old.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids: break
+            deleted += Task.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Удалено задач: {deleted}.'))
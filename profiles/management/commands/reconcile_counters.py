@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from profiles import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает закэшированные счетчики бейджей (уведомления, сообщения, симпатии) по данным БД.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size, total, last_id = options['batch_size'], 0, 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not user_ids: break
+            total += counters.reconcile(user_ids)
+            last_id = user_ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Счетчики пересчитаны для {total} пользователей.'))
@@ -0,0 +1,75 @@
+import multiprocessing
+import signal
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from profiles import taskqueue
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновой очереди задач: забирает задачи из таблицы Task и выполняет их в пуле.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Размер пула')
+        parser.add_argument('--processes', action='store_true', help='Пул процессов вместо пула потоков')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Пауза между опросами пустой очереди, с')
+        parser.add_argument('--stats-interval', type=float, default=60.0, help='Как часто печатать метрики, с')
+        parser.add_argument('--once', action='store_true', help='Выполнить доступные задачи и выйти')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['processes']:
+            # spawn, а не fork: дочерние процессы не должны наследовать открытые соединения с БД
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task-worker')
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop); signal.signal(signal.SIGINT, self.stop)
+        self.stats = defaultdict(list)
+        self.stats_started = last_stats = last_requeue = time.monotonic()
+        running = set()
+        self.stdout.write(f'Воркер запущен: {workers} {"процессов" if options["processes"] else "потоков"}, задачи: {", ".join(sorted(taskqueue.registry))}')
+        if settings.TASKS_EAGER: self.stdout.write('TASKS_EAGER включен: новые задачи выполняет веб-процесс, воркер разберет только уже стоящие в очереди')
+        try:
+            while not self.stopping:
+                if time.monotonic() - last_requeue > 30:
+                    requeued = taskqueue.requeue_stale(); last_requeue = time.monotonic()
+                    if requeued: self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}')
+                free = workers - len(running)
+                task_ids = taskqueue.claim(free) if free else []
+                running |= {executor.submit(taskqueue.execute, task_id) for task_id in task_ids}
+                if running:
+                    done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done: self.record(*future.result())
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+                if time.monotonic() - last_stats > options['stats_interval']:
+                    self.report(); last_stats = time.monotonic()
+        finally:
+            # Дожидаемся начатых задач, чтобы они не остались в RUNNING
+            for future in wait(running).done: self.record(*future.result())
+            executor.shutdown(wait=True)
+            self.report()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def record(self, name, ok, duration_ms):
+        self.stats[name].append((ok, duration_ms))
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.stats_started, 1e-9)
+        for name, samples in sorted(self.stats.items()):
+            durations = sorted(duration for _, duration in samples)
+            failed = sum(1 for ok, _ in samples if not ok)
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            self.stdout.write(
+                f'{name}: {len(samples)} шт. ({len(samples) / elapsed:.1f}/с), ошибок {failed}, '
+                f'среднее {sum(durations) / len(durations):.0f} мс, p95 {p95} мс, макс {durations[-1]} мс'
+            )
+        self.stats.clear(); self.stats_started = time.monotonic()
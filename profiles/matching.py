@@ -0,0 +1,153 @@
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.utils import timezone
+from .models import UserProfile, Like
+
+# Порядок столбцов в векторе признаков анкеты
+GENDER, MARITAL, CHILDREN, CHURCHING, FASTING, SACRAMENTS, HEIGHT, BIRTH = range(8)
+FEATURE_FIELDS = ('gender', 'marital_status', 'children', 'churching_level', 'attitude_to_fasting', 'sacraments', 'height', 'date_of_birth')
+
+CODES = {
+    'gender': {value: i for i, (value, _) in enumerate(UserProfile.GENDER_CHOICES)},
+    'marital_status': {value: i for i, (value, _) in enumerate(UserProfile.MARITAL_STATUS_CHOICES)},
+    'children': {value: i for i, (value, _) in enumerate(UserProfile.CHILDREN_CHOICES)},
+    'churching_level': {value: i for i, (value, _) in enumerate(UserProfile.CHURCHING_LEVEL_CHOICES)},
+    'attitude_to_fasting': {value: i for i, (value, _) in enumerate(UserProfile.ATTITUDE_TO_FASTING_CHOICES)},
+    # Регулярно=2, Иногда=1, Редко=0 — чтобы разница кодов означала "насколько далеко"
+    'sacraments': {value: len(UserProfile.SACRAMENTS_CHOICES) - 1 - i for i, (value, _) in enumerate(UserProfile.SACRAMENTS_CHOICES)},
+}
+
+WEIGHTS = {'churching': 3.0, 'fasting': 2.0, 'sacraments': 2.0, 'marital': 1.0, 'children': 1.0, 'age': 3.0, 'height': 1.0}
+AGE_SCALE_DAYS = 365.25 * 5   # разница в 5 лет снижает вклад возраста в e раз
+REFRESH_INTERVAL = 60         # секунд между запросами правок, сделанных в других процессах
+REFRESH_OVERLAP = timedelta(seconds=5)  # правки, закоммиченные во время запроса, не теряются: берутся повторно
+
+
+def encode(values):
+    """values — кортеж значений полей FEATURE_FIELDS; возвращает строку матрицы признаков."""
+    gender, marital, children, churching, fasting, sacraments, height, birth = values
+    return (
+        CODES['gender'].get(gender, -1), CODES['marital_status'].get(marital, -1),
+        CODES['children'].get(children, -1), CODES['churching_level'].get(churching, -1),
+        CODES['attitude_to_fasting'].get(fasting, -1), CODES['sacraments'].get(sacraments, -1),
+        height or 0, birth.toordinal() if birth else 0,
+    )
+
+
+class ProfileVectorStore:
+    """
+    Предвычисленные признаки всех анкет в одном массиве int32 (строка на анкету),
+    чтобы оценивать всех кандидатов одним векторным проходом NumPy вместо цикла по ORM-объектам.
+    Хранилище живет в памяти процесса и целиком загружается один раз, при первом обращении. Дальше
+    оно обновляется построчно: правки этого процесса — из сигналов, других процессов — раз в
+    REFRESH_INTERVAL запросом только измененных строк по индексу updated_at. Анкеты, удаленные в
+    других процессах, остаются до перезапуска, но recommended_profiles их отбрасывает.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._since = None
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.features = np.empty((0, len(FEATURE_FIELDS)), dtype=np.int32)
+        self.size = 0
+        self.rows = {}
+
+    @property
+    def loaded(self): return self._loaded_at is not None
+
+    def load(self):
+        since = timezone.now() - REFRESH_OVERLAP
+        data = list(UserProfile.objects.values_list('user_id', *FEATURE_FIELDS))
+        user_ids = np.fromiter((row[0] for row in data), dtype=np.int64, count=len(data))
+        features = np.array([encode(row[1:]) for row in data], dtype=np.int32).reshape(len(data), len(FEATURE_FIELDS))
+        with self._lock:
+            self.user_ids, self.features, self.size = user_ids, features, len(data)
+            self.rows = {int(user_id): i for i, user_id in enumerate(user_ids)}
+            self._loaded_at, self._since = time.monotonic(), since
+
+    def refresh(self):
+        """Применяет анкеты, измененные с прошлого обращения к БД."""
+        since = timezone.now() - REFRESH_OVERLAP
+        for user_id, *values in UserProfile.objects.filter(updated_at__gte=self._since).values_list('user_id', *FEATURE_FIELDS):
+            self._set(user_id, encode(values))
+        self._loaded_at, self._since = time.monotonic(), since
+
+    def ensure_loaded(self):
+        if not self.loaded: self.load()
+        elif time.monotonic() - self._loaded_at > REFRESH_INTERVAL: self.refresh()
+
+    def update(self, profile):
+        if not self.loaded: return
+        self._set(profile.user_id, encode(tuple(getattr(profile, field) for field in FEATURE_FIELDS)))
+
+    def _set(self, user_id, vector):
+        with self._lock:
+            row = self.rows.get(user_id)
+            if row is None:
+                if self.size == len(self.user_ids):  # растим массивы с запасом, чтобы вставка была амортизированно O(1)
+                    capacity = max(16, 2 * len(self.user_ids))
+                    self.user_ids = np.resize(self.user_ids, capacity)
+                    self.features = np.resize(self.features, (capacity, len(FEATURE_FIELDS)))
+                row = self.size; self.size += 1
+                self.rows[user_id] = row
+            self.user_ids[row] = user_id
+            self.features[row] = vector
+
+    def remove(self, user_id):
+        if not self.loaded: return
+        with self._lock:
+            row = self.rows.pop(user_id, None)
+            if row is None: return
+            last = self.size - 1
+            if row != last:  # переносим последнюю строку на место удаленной
+                self.user_ids[row] = self.user_ids[last]; self.features[row] = self.features[last]
+                self.rows[int(self.user_ids[row])] = row
+            self.size = last
+
+    def scores(self, user_id, exclude=()):
+        """Возвращает (user_ids кандидатов, оценки) для анкет противоположного пола."""
+        self.ensure_loaded()
+        with self._lock:
+            row = self.rows.get(user_id)
+            if row is None: return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            me = self.features[row].copy()
+            features, user_ids = self.features[:self.size], self.user_ids[:self.size]
+            mask = features[:, GENDER] != me[GENDER]
+            if exclude: mask &= ~np.isin(user_ids, np.fromiter(exclude, dtype=np.int64))
+            candidates, ids = features[mask], user_ids[mask].copy()
+
+        score = np.zeros(len(ids), dtype=np.float32)
+        score += WEIGHTS['churching'] * (candidates[:, CHURCHING] == me[CHURCHING])
+        score += WEIGHTS['fasting'] * (candidates[:, FASTING] == me[FASTING])
+        score += WEIGHTS['sacraments'] * (1 - np.abs(candidates[:, SACRAMENTS] - me[SACRAMENTS]) / 2)
+        score += WEIGHTS['marital'] * (candidates[:, MARITAL] == me[MARITAL])
+        score += WEIGHTS['children'] * (candidates[:, CHILDREN] == me[CHILDREN])
+        if me[BIRTH]:
+            age_gap = np.abs(candidates[:, BIRTH] - me[BIRTH]).astype(np.float32)
+            score += WEIGHTS['age'] * np.exp(-age_gap / AGE_SCALE_DAYS) * (candidates[:, BIRTH] > 0)
+        if me[HEIGHT]:
+            # Традиционно мужчина выше: бонус, если рост кандидата "на нужной стороне" от своего
+            man = me[GENDER] == CODES['gender']['Мужчина']
+            preferred = candidates[:, HEIGHT] < me[HEIGHT] if man else candidates[:, HEIGHT] > me[HEIGHT]
+            score += WEIGHTS['height'] * (preferred & (candidates[:, HEIGHT] > 0))
+        return ids, score
+
+    def top_k(self, user_id, k=24, exclude=()):
+        ids, score = self.scores(user_id, exclude)
+        if len(ids) > k:
+            part = np.argpartition(-score, k)[:k]
+            ids, score = ids[part], score[part]
+        order = np.argsort(-score, kind='stable')
+        return [(int(ids[i]), float(score[i])) for i in order]
+
+
+vector_store = ProfileVectorStore()
+
+
+def recommended_profiles(user, k=24):
+    exclude = set(Like.objects.filter(user_from=user).values_list('user_to_id', flat=True))
+    ranked = vector_store.top_k(user.id, k=k, exclude=exclude)
+    profiles = UserProfile.objects.select_related('user').in_bulk([user_id for user_id, _ in ranked], field_name='user_id')
+    return [profiles[user_id] for user_id, _ in ranked if user_id in profiles]
@@ -0,0 +1,155 @@
+"""
+Метрики процесса: длительность запросов и WebSocket-соединений, число и время SQL-запросов,
+повторяющиеся запросы (N+1) и самый медленный SQL по каждому маршруту. Все хранится в памяти
+процесса (у каждого воркера свои значения) и отдается в текстовом формате Prometheus на /metrics/.
+
+SQL учитывается через execute_wrapper, который вешается на каждое соединение с БД; запрос
+относится к тому сборщику (QueryStats), что лежит в contextvar текущего запроса или сокета.
+contextvar переезжает и в потоки sync_to_async, поэтому учитываются и запросы из async-кода.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import Counter, defaultdict
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+DUPLICATE_THRESHOLD = 5   # один и тот же SQL столько раз за запрос — похоже на N+1
+SQL_PREVIEW = 300
+
+current_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+class QueryStats:
+    __slots__ = ('count', 'seconds', 'statements', 'slowest', 'slowest_sql')
+
+    def __init__(self):
+        self.count, self.seconds = 0, 0.0
+        self.statements = Counter()
+        self.slowest, self.slowest_sql = 0.0, ''
+
+    def add(self, sql, seconds):
+        self.count += 1; self.seconds += seconds
+        self.statements[sql] += 1
+        if seconds > self.slowest: self.slowest, self.slowest_sql = seconds, sql
+
+    def duplicates(self):
+        """Самый часто повторенный SQL и число повторов, если это похоже на N+1."""
+        if not self.statements: return None, 0
+        sql, times = self.statements.most_common(1)[0]
+        return (sql, times) if times >= DUPLICATE_THRESHOLD else (None, 0)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None: return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - started)
+
+
+def install(connection, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers: connection.execute_wrappers.append(execute_wrapper)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'total')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum, self.total = 0.0, 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts): self.counts[index] += 1
+        self.sum += value; self.total += 1
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class Registry:
+    """Счетчики, гистограммы и значения "максимум" с метками; запись под одной блокировкой."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.help = {}
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.slowest_sql = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, labels, value=1):
+        with self._lock: self.counters[name, labels] += value
+
+    def shift(self, name, labels, delta):
+        with self._lock: self.gauges[name, labels] = self.gauges.get((name, labels), 0) + delta
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None: histogram = self.histograms[name, labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_slowest(self, route, seconds, sql):
+        with self._lock:
+            if seconds <= self.slowest_sql.get(route, (0.0, ''))[0]: return
+            self.slowest_sql[route] = (seconds, sql)
+            self.gauges['db_slowest_query_seconds', (('route', route),)] = seconds
+
+    def render(self):
+        with self._lock:
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.total) for key, h in self.histograms.items()}
+            slowest = dict(self.slowest_sql)
+        lines, described = [], set()
+
+        def header(name):
+            if name in described or name not in self.help: return
+            kind, text = self.help[name]
+            lines.extend((f'# HELP {name} {text}', f'# TYPE {name} {kind}')); described.add(name)
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name); lines.append(f'{name}{{{_labels(labels)}}} {value:g}')
+        for (name, labels), value in sorted(gauges.items()):
+            header(name); lines.append(f'{name}{{{_labels(labels)}}} {value:g}')
+        for (name, labels), (buckets, counts, total_sum, total) in sorted(histograms.items()):
+            header(name)
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(labels + (("le", f"{bound:g}"),))}}} {cumulative}')
+            lines.append(f'{name}_bucket{{{_labels(labels + (("le", "+Inf"),))}}} {total}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {total_sum:g}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {total}')
+        # Текст запроса в метку не кладем (неограниченная кардинальность) — только комментарием
+        for route, (seconds, sql) in sorted(slowest.items()):
+            lines.append(f'# slowest_sql route="{_escape(route)}" {seconds * 1000:.1f}ms: {" ".join(sql[:SQL_PREVIEW].split())}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'HTTP-запросы по маршруту, методу и статусу')
+registry.describe('http_request_duration_seconds', 'histogram', 'Длительность HTTP-запроса')
+registry.describe('http_request_db_queries', 'histogram', 'Число SQL-запросов на HTTP-запрос')
+registry.describe('http_request_db_seconds', 'histogram', 'Суммарное время SQL на HTTP-запрос')
+registry.describe('http_duplicate_queries_total', 'counter', 'HTTP-запросы с повторяющимся SQL (похоже на N+1)')
+registry.describe('db_slowest_query_seconds', 'gauge', 'Самый медленный SQL-запрос маршрута с запуска процесса')
+registry.describe('websocket_connections_total', 'counter', 'Открытые WebSocket-соединения')
+registry.describe('websocket_active_connections', 'gauge', 'WebSocket-соединения, открытые сейчас')
+registry.describe('websocket_connection_duration_seconds', 'histogram', 'Длительность WebSocket-соединения')
+registry.describe('websocket_frames_total', 'counter', 'Кадры WebSocket по направлению')
+registry.describe('websocket_db_queries_total', 'counter', 'SQL-запросы, выполненные при обслуживании сокетов')
+registry.describe('websocket_db_seconds_total', 'counter', 'Время SQL при обслуживании сокетов')
+
@@ -0,0 +1,150 @@
+import cProfile
+import logging
+import os
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .metrics import QueryStats, current_stats, registry, QUERY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class QueryMetricsMiddleware:
+    """
+    Замеряет каждый HTTP-запрос: длительность, число и время SQL, N+1 и самый медленный SQL
+    по имени маршрута. Стоит первым в MIDDLEWARE, чтобы учитывать запросы сессий и авторизации.
+    При METRICS_PROFILE_SAMPLE_RATE > 0 часть запросов профилируется cProfile, и профиль
+    сохраняется в METRICS_PROFILE_DIR, если запрос дольше METRICS_PROFILE_THRESHOLD_MS.
+    Под ASGI работает асинхронно, чтобы не переводить async-вьюхи в поток; такие запросы
+    не профилируются — cProfile на цикле событий смешал бы чужие корутины.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_PROFILE_SAMPLE_RATE', 0.0)
+        self.threshold = getattr(settings, 'METRICS_PROFILE_THRESHOLD_MS', 1000) / 1000
+        if iscoroutinefunction(get_response): markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self): return self.__acall__(request)
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        profiler = cProfile.Profile() if self.sample_rate and random.random() < self.sample_rate else None
+        response, started = None, time.perf_counter()
+        try:
+            response = self.get_response(request) if profiler is None else profiler.runcall(self.get_response, request)
+            return response
+        finally:
+            duration = time.perf_counter() - started
+            current_stats.reset(token)
+            match = getattr(request, 'resolver_match', None)
+            route = match.view_name if match else 'unmatched'
+            self.record(request, route, response.status_code if response is not None else 500, duration, stats)
+            if profiler is not None and duration >= self.threshold: self.dump(profiler, route)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        response, started = None, time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            current_stats.reset(token)
+            match = getattr(request, 'resolver_match', None)
+            self.record(request, match.view_name if match else 'unmatched', response.status_code if response is not None else 500,
+                        time.perf_counter() - started, stats)
+
+    def record(self, request, route, status, duration, stats):
+        labels = (('route', route),)
+        registry.inc('http_requests_total', (('route', route), ('method', request.method), ('status', str(status))))
+        registry.observe('http_request_duration_seconds', labels, duration)
+        registry.observe('http_request_db_queries', labels, stats.count, QUERY_BUCKETS)
+        registry.observe('http_request_db_seconds', labels, stats.seconds)
+        if stats.slowest: registry.record_slowest(route, stats.slowest, stats.slowest_sql)
+        sql, times = stats.duplicates()
+        if sql is not None:
+            registry.inc('http_duplicate_queries_total', labels)
+            logger.warning('%s %s: %s одинаковых SQL-запросов за запрос (N+1?): %s', request.method, request.path, times, sql[:300])
+
+    def dump(self, profiler, route):
+        directory = getattr(settings, 'METRICS_PROFILE_DIR', None)
+        if not directory: return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{route.replace(":", "-")}-{timezone.now():%Y%m%d-%H%M%S-%f}.prof')
+        profiler.dump_stats(path)
+        logger.info('Профиль медленного запроса %s сохранен в %s', route, path)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, который под ASGI не переводит всю цепочку middleware в синхронный режим:
+    статика отдается из потока, остальные запросы сразу идут дальше по async-цепочке.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response): markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self): return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = await sync_to_async(self.find_file)(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None: return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class WebsocketMetricsMiddleware:
+    """
+    ASGI-обертка над приложением: для WebSocket-соединений считает длительность, кадры
+    в обе стороны и SQL, выполненный консьюмером (через contextvar на все время соединения).
+    HTTP проходит насквозь — его меряет QueryMetricsMiddleware.
+    """
+    def __init__(self, application, routes):
+        self.application = application
+        self.routes = routes
+
+    def route_for(self, path):
+        path = path.lstrip('/')
+        for pattern in self.routes:
+            if pattern.pattern.match(path): return pattern.name or str(pattern.pattern)
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket': return await self.application(scope, receive, send)
+        route = self.route_for(scope['path'])
+        labels = (('route', route),)
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        accepted, started = False, time.perf_counter()
+
+        async def counting_receive():
+            message = await receive()
+            if message['type'] == 'websocket.receive': registry.inc('websocket_frames_total', labels + (('direction', 'in'),))
+            return message
+
+        async def counting_send(message):
+            nonlocal accepted
+            if message['type'] == 'websocket.send': registry.inc('websocket_frames_total', labels + (('direction', 'out'),))
+            elif message['type'] == 'websocket.accept' and not accepted:
+                accepted = True
+                registry.inc('websocket_connections_total', labels); registry.shift('websocket_active_connections', labels, 1)
+            return await send(message)
+
+        try:
+            return await self.application(scope, counting_receive, counting_send)
+        finally:
+            current_stats.reset(token)
+            if accepted:
+                registry.shift('websocket_active_connections', labels, -1)
+                registry.observe('websocket_connection_duration_seconds', labels, time.perf_counter() - started)
+            registry.inc('websocket_db_queries_total', labels, stats.count)
+            registry.inc('websocket_db_seconds_total', labels, stats.seconds)
+            if stats.slowest: registry.record_slowest(route, stats.slowest, stats.slowest_sql)
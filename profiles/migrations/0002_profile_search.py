@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_city_normalized(apps, schema_editor):
+    UserProfile = apps.get_model('profiles', 'UserProfile')
+    profiles = list(UserProfile.objects.only('id', 'city'))
+    for profile in profiles:
+        profile.city_normalized = ' '.join(profile.city.lower().replace('ё', 'е').split())
+    UserProfile.objects.bulk_update(profiles, ['city_normalized'], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='city_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['gender', 'churching_level', 'date_of_birth'], name='profile_search_idx'),
+        ),
+        migrations.RunPython(fill_city_normalized, migrations.RunPython.noop),
+    ]
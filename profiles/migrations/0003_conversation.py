@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_conversations(apps, schema_editor):
+    # История до появления сводок считается прочитанной: is_read никогда не выставлялся
+    Message = apps.get_model('profiles', 'Message')
+    Conversation = apps.get_model('profiles', 'Conversation')
+    latest = {}
+    for message in Message.objects.only('id', 'sender_id', 'receiver_id', 'content', 'timestamp').order_by('id').iterator():
+        pair = tuple(sorted((message.sender_id, message.receiver_id)))
+        latest[pair] = message
+    Conversation.objects.bulk_create([
+        Conversation(user_low_id=low, user_high_id=high, last_message_id=message.id,
+                     preview=message.content[:100], last_activity=message.timestamp)
+        for (low, high), message in latest.items()
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_profile_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preview', models.CharField(blank=True, max_length=100)),
+                ('last_activity', models.DateTimeField()),
+                ('unread_low', models.PositiveIntegerField(default=0)),
+                ('unread_high', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='profiles.message')),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_low', '-last_activity', '-id'], name='conversation_low_activity_idx'), models.Index(fields=['user_high', '-last_activity', '-id'], name='conversation_high_activity_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='conversation_pair_unique'),
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_matches(apps, schema_editor):
+    Like = apps.get_model('profiles', 'Like')
+    Match = apps.get_model('profiles', 'Match')
+    likes = set(Like.objects.values_list('user_from_id', 'user_to_id').iterator())
+    pairs = {tuple(sorted(pair)) for pair in likes if pair[::-1] in likes}
+    Match.objects.bulk_create([Match(user_low_id=low, user_high_id=high) for low, high in pairs], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_high', '-created_at'], name='match_high_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='match',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='match_pair_unique'),
+        ),
+        migrations.RunPython(build_matches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:40
+
+from django.db import migrations
+
+FIELDS = ('favorite_saints', 'spiritual_books', 'about_me')
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE profiles_userprofile ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(favorite_saints, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(spiritual_books, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(about_me, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX profile_search_vector_idx ON profiles_userprofile USING GIN (search_vector)',
+]
+POSTGRES_BACKWARD = ['DROP INDEX IF EXISTS profile_search_vector_idx', 'ALTER TABLE profiles_userprofile DROP COLUMN IF EXISTS search_vector']
+
+FOLDED = ', '.join(f"replace(replace({field}, 'ё', 'е'), 'Ё', 'Е')" for field in FIELDS)
+SQLITE_FORWARD = [
+    f"CREATE VIRTUAL TABLE profiles_userprofile_fts USING fts5({', '.join(FIELDS)}, tokenize='unicode61 remove_diacritics 2')",
+    f"INSERT INTO profiles_userprofile_fts (rowid, {', '.join(FIELDS)}) SELECT id, {FOLDED} FROM profiles_userprofile",
+]
+SQLITE_BACKWARD = ['DROP TABLE IF EXISTS profiles_userprofile_fts']
+
+
+def run(statements):
+    # Индексы зависят от СУБД: tsvector + GIN на PostgreSQL, FTS5 на SQLite, на прочих — ничего
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0006_message_pair_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def load_gazetteer(apps, schema_editor):
+    from profiles import gazetteer
+    gazetteer.load(apps.get_model('profiles', 'City'), apps.get_model('profiles', 'UserProfile'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0007_profile_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('region', models.CharField(blank=True, max_length=100, verbose_name='Регион')),
+                ('latitude', models.FloatField(verbose_name='Широта')),
+                ('longitude', models.FloatField(verbose_name='Долгота')),
+                ('population', models.PositiveIntegerField(default=0, verbose_name='Население')),
+                ('geohash', models.CharField(db_index=True, max_length=12)),
+            ],
+            options={
+                'verbose_name': 'Город',
+                'verbose_name_plural': 'Города',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='city_ref',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profiles', to='profiles.city', verbose_name='Город из справочника'),
+        ),
+        migrations.RunPython(load_gazetteer, migrations.RunPython.noop),
+    ]
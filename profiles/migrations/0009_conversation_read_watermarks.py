@@ -0,0 +1,52 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+def counters_to_watermarks(apps, schema_editor):
+    # Знак ставится так, чтобы непрочитанных осталось столько же, сколько было в счетчике
+    Message = apps.get_model('profiles', 'Message')
+    Conversation = apps.get_model('profiles', 'Conversation')
+    batch = []
+    for conversation in Conversation.objects.order_by('id').iterator(chunk_size=2000):
+        for side, other in (('low', 'high'), ('high', 'low')):
+            unread = getattr(conversation, f'unread_{side}')
+            if not unread:
+                watermark = conversation.last_message_id or 0
+            else:
+                incoming = Message.objects.filter(sender_id=getattr(conversation, f'user_{other}_id'), receiver_id=getattr(conversation, f'user_{side}_id'))
+                oldest_unread = incoming.order_by('-id').values_list('id', flat=True)[unread - 1:unread].first()
+                watermark = oldest_unread - 1 if oldest_unread else 0
+            setattr(conversation, f'read_{side}', watermark)
+        batch.append(conversation)
+        if len(batch) >= 2000:
+            Conversation.objects.bulk_update(batch, ['read_low', 'read_high']); batch = []
+    Conversation.objects.bulk_update(batch, ['read_low', 'read_high'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0008_city_gazetteer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='read_high',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='read_low',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(counters_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='unread_high',
+        ),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='unread_low',
+        ),
+    ]
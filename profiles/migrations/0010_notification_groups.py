@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:38
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.db.models.functions import Cast
+
+
+def merge_unread(apps, schema_editor):
+    # Непрочитанные дубли каждой группы сливаются в самое новое уведомление группы
+    Notification = apps.get_model('profiles', 'Notification')
+    Notification.objects.filter(notification_type='MESSAGE', sender__isnull=False).update(group_key=Cast('sender_id', models.CharField()))
+    groups = (Notification.objects.filter(is_read=False).values('recipient_id', 'notification_type', 'group_key').order_by()
+              .annotate(rows=Count('id'), keep=Max('id')).filter(rows__gt=1))
+    for group in groups.iterator():
+        keep = group.pop('keep'); rows = group.pop('rows')
+        Notification.objects.filter(is_read=False, **group).exclude(id=keep).delete()
+        Notification.objects.filter(id=keep).update(count=rows)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0009_conversation_read_watermarks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1, verbose_name='Событий'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='group_key',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_idx'),
+        ),
+        migrations.RunPython(merge_unread, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_read', False)), fields=('recipient', 'notification_type', 'group_key'), name='notification_unread_group_unique'),
+        ),
+    ]
@@ -1,8 +1,31 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, Count, OuterRef, Subquery, Case, When, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import date
 from django.urls import reverse
+from .lru import LRUCache
+from . import gazetteer
+
+def normalize_city(value):
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+class City(models.Model):
+    """Город из встроенного справочника profiles/data/cities.csv (id берутся из файла)."""
+    name = models.CharField(max_length=100, verbose_name="Название")
+    region = models.CharField(max_length=100, blank=True, verbose_name="Регион")
+    latitude = models.FloatField(verbose_name="Широта")
+    longitude = models.FloatField(verbose_name="Долгота")
+    population = models.PositiveIntegerField(default=0, verbose_name="Население")
+    geohash = models.CharField(max_length=12, db_index=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = "Город"
+        verbose_name_plural = "Города"
+
+    def __str__(self): return f'{self.name} ({self.region})' if self.region and self.region != self.name else self.name
 
 class UserProfile(models.Model):
     GENDER_CHOICES = (('Мужчина', 'Мужчина'), ('Женщина', 'Женщина'))
@@ -17,6 +40,8 @@ class UserProfile(models.Model):
     date_of_birth = models.DateField(verbose_name="Дата рождения")
     gender = models.CharField(max_length=10, choices=GENDER_CHOICES, verbose_name="Пол")
     city = models.CharField(max_length=100, verbose_name="Город")
+    city_normalized = models.CharField(max_length=100, editable=False, default='', db_index=True)
+    city_ref = models.ForeignKey(City, null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='profiles', verbose_name="Город из справочника")
     photo = models.ImageField(upload_to='profile_pics/%Y/%m/%d/', default='default.jpg', verbose_name="Фотография профиля")
     about_me = models.TextField(blank=True, verbose_name="О себе")
     height = models.PositiveIntegerField(blank=True, null=True, verbose_name="Рост (см)")
@@ -30,9 +55,24 @@ class UserProfile(models.Model):
     favorite_saints = models.CharField(max_length=255, blank=True, verbose_name="Любимые святые")
     spiritual_books = models.TextField(blank=True, verbose_name="Любимые духовные книги")
     is_verified = models.BooleanField(default=False, verbose_name="Верифицирован")
+    # По нему matching.ProfileVectorStore подтягивает правки, сделанные в других процессах
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['gender', 'churching_level', 'date_of_birth'], name='profile_search_idx')]
 
     def __str__(self): return f'Профиль пользователя {self.user.username}'
 
+    def save(self, *args, **kwargs):
+        self.city_normalized = normalize_city(self.city)
+        self.city_ref_id = gazetteer.resolve(self.city)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'updated_at'}
+            if 'city' in update_fields: update_fields |= {'city_normalized', 'city_ref'}
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     @property
     def age(self):
         if self.date_of_birth:
@@ -46,13 +86,163 @@ class Like(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta: unique_together = ('user_from', 'user_to')
 
+class Match(models.Model):
+    """Взаимная симпатия: создается в add_like, когда находится встречный Like. Пара упорядочена по id."""
+    user_low = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user_low', 'user_high'], name='match_pair_unique')]
+        indexes = [models.Index(fields=['user_high', '-created_at'], name='match_high_idx')]
+
+    # Кэшируются только найденные пары: симпатия не отзывается, поэтому положительный ответ не устаревает
+    _cache = LRUCache(maxsize=50000)
+
+    @staticmethod
+    def pair(a_id, b_id): return (a_id, b_id) if a_id < b_id else (b_id, a_id)
+
+    @classmethod
+    def exists_between(cls, a, b):
+        key = cls.pair(a.id, b.id)
+        if cls._cache.get(key): return True
+        found = cls.objects.filter(user_low_id=key[0], user_high_id=key[1]).exists()
+        if found: cls._cache.set(key, True)
+        return found
+
+    @classmethod
+    def for_user(cls, user):
+        return cls.objects.filter(Q(user_low=user) | Q(user_high=user))
+
+    def interlocutor_for(self, user):
+        return self.user_high if self.user_low_id == user.id else self.user_low
+
+    @classmethod
+    def record_like(cls, like):
+        """Вызывается внутри транзакции add_like; создает Match, если симпатия стала взаимной."""
+        low, high = cls.pair(like.user_from_id, like.user_to_id)
+        # Блокируем обоих пользователей в одном порядке, чтобы встречные лайки не разминулись
+        list(User.objects.select_for_update().filter(id__in=(low, high)).order_by('id').values_list('id', flat=True))
+        if not Like.objects.filter(user_from_id=like.user_to_id, user_to_id=like.user_from_id).exists(): return None
+        match, _ = cls.objects.get_or_create(user_low_id=low, user_high_id=high)
+        return match
+
+class LikeCandidate(models.Model):
+    """Кандидат во взаимную симпатию по графу лайков (profiles/likegraph.py); таблицу пересчитывает manage.py build_candidates."""
+    # Отдельный индекс по user не нужен: его заменяет уникальный (user, rank)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, db_index=False)
+    candidate = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'rank'], name='likecandidate_rank_unique')]
+
 class Message(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Не обновляется: прочитанность хранят водяные знаки Conversation.read_low/read_high.
+    # Флаг остается для импорта, экспорта и архива
     is_read = models.BooleanField(default=False)
-    class Meta: ordering = ['timestamp']
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [models.Index(fields=['sender', 'receiver', 'id'], name='message_pair_idx')]
+
+    @classmethod
+    def between(cls, a_id, b_id):
+        return cls.objects.filter(Q(sender_id=a_id, receiver_id=b_id) | Q(sender_id=b_id, receiver_id=a_id))
+
+class Conversation(models.Model):
+    """
+    Денормализованная сводка диалога для списка сообщений: одна строка на пару пользователей
+    (user_low.id < user_high.id) и последнее сообщение. Обновляется при каждой записи Message,
+    поэтому инбокс читается одним запросом.
+
+    Прочитанность — водяной знак на каждую сторону: id последнего прочитанного сообщения
+    (read_low, read_high). Непрочитанные — входящие сообщения с id больше знака; их считает
+    индекс message_pair_idx (sender, receiver, id), просматривая только непрочитанный хвост.
+    Отметка «прочитано» — один UPDATE строки диалога при любой длине истории.
+    """
+    PREVIEW_LENGTH = 100
+    user_low = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_activity = models.DateTimeField()
+    read_low = models.PositiveBigIntegerField(default=0)
+    read_high = models.PositiveBigIntegerField(default=0)
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user_low', 'user_high'], name='conversation_pair_unique')]
+        indexes = [
+            models.Index(fields=['user_low', '-last_activity', '-id'], name='conversation_low_activity_idx'),
+            models.Index(fields=['user_high', '-last_activity', '-id'], name='conversation_high_activity_idx'),
+        ]
+
+    @staticmethod
+    def pair(a_id, b_id): return (a_id, b_id) if a_id < b_id else (b_id, a_id)
+
+    @classmethod
+    def for_user(cls, user):
+        return cls.objects.filter(Q(user_low=user) | Q(user_high=user))
+
+    def interlocutor_for(self, user):
+        return self.user_high if self.user_low_id == user.id else self.user_low
+
+    def read_by(self, user_id):
+        """Водяной знак прочитанного для стороны user_id."""
+        return self.read_low if self.user_low_id == user_id else self.read_high
+
+    @staticmethod
+    def unread_side(side):
+        """Выражение: число непрочитанных сообщений стороны side ('low' или 'high') в диалоге."""
+        other = 'high' if side == 'low' else 'low'
+        unread = (Message.objects.filter(sender_id=OuterRef(f'user_{other}_id'), receiver_id=OuterRef(f'user_{side}_id'), id__gt=OuterRef(f'read_{side}'))
+                  .order_by().values('receiver_id').annotate(total=Count('id')).values('total'))
+        return Coalesce(Subquery(unread), Value(0))
+
+    @classmethod
+    def unread_for(cls, user_id):
+        """Выражение для annotate: непрочитанные сообщения user_id в диалоге."""
+        return Case(When(user_low_id=user_id, then=cls.unread_side('low')), default=cls.unread_side('high'))
+
+    @classmethod
+    def unread_totals(cls, user_ids):
+        """{user_id: непрочитанных сообщений во всех диалогах} — по запросу на сторону диалога."""
+        totals = dict.fromkeys(user_ids, 0)
+        for side in ('low', 'high'):
+            rows = cls.objects.filter(**{f'user_{side}_id__in': user_ids}).annotate(unread=cls.unread_side(side)).filter(unread__gt=0)
+            for user_id, unread in rows.values_list(f'user_{side}_id', 'unread'): totals[user_id] += unread
+        return totals
+
+    @classmethod
+    def record_message(cls, message):
+        cls.record_messages([message])
+
+    @classmethod
+    def record_messages(cls, messages):
+        """Обновляет сводки по пачке сообщений: один UPDATE на пару пользователей."""
+        by_pair = {}
+        for message in messages: by_pair[cls.pair(message.sender_id, message.receiver_id)] = message
+        for (low, high), message in by_pair.items():
+            values = {'last_message': message, 'preview': message.content[:cls.PREVIEW_LENGTH], 'last_activity': message.timestamp}
+            if cls.objects.filter(user_low_id=low, user_high_id=high).update(**values): continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(user_low_id=low, user_high_id=high, **values)
+            except IntegrityError:  # диалог успели создать параллельно
+                cls.objects.filter(user_low_id=low, user_high_id=high).update(**values)
+
+    @classmethod
+    def mark_read(cls, user_id, interlocutor_id, message_id):
+        """
+        Сдвигает водяной знак user_id до message_id одним UPDATE. Знак только растет и не уходит
+        дальше последнего сообщения диалога; возвращает True, если он сдвинулся.
+        """
+        low, high = cls.pair(user_id, interlocutor_id)
+        field = 'read_low' if user_id == low else 'read_high'
+        return bool(cls.objects.filter(user_low_id=low, user_high_id=high, last_message_id__gte=message_id, **{f'{field}__lt': message_id})
+                    .update(**{field: message_id}))
 
 class Photo(models.Model):
     user_profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='photos', verbose_name="Профиль пользователя")
@@ -61,23 +251,80 @@ class Photo(models.Model):
     class Meta: verbose_name = "Фотография"; verbose_name_plural = "Фотографии"; ordering = ['-uploaded_at']
 
 class Notification(models.Model):
+    """
+    Уведомление. Повторные события, пока уведомление не прочитано, не добавляют строк: они
+    сливаются в одну (Notification.record) с числом событий count. Симпатии сливаются все вместе,
+    сообщения — по отправителю (group_key). Прочитанные старые уведомления удаляет prune_notifications.
+    """
     NOTIFICATION_TYPES = (('LIKE', 'Новая симпатия'), ('MESSAGE', 'Новое сообщение'))
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', verbose_name="Получатель")
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_notifications', verbose_name="Отправитель", null=True, blank=True)
     message = models.TextField(verbose_name="Сообщение")
     notification_type = models.CharField(max_length=10, choices=NOTIFICATION_TYPES, verbose_name="Тип уведомления")
+    group_key = models.CharField(max_length=50, blank=True, editable=False)
+    count = models.PositiveIntegerField(default=1, verbose_name="Событий")
     is_read = models.BooleanField(default=False, verbose_name="Прочитано")
+    # Время последнего события: при слиянии обновляется, и уведомление поднимается вверх списка
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
-    class Meta: verbose_name = "Уведомление"; verbose_name_plural = "Уведомления"; ordering = ['-created_at']
-    @property
-    def link(self):
-        if self.notification_type == 'LIKE' and self.sender: return reverse('profiles:profile_detail', kwargs={'pk': self.sender.pk})
-        elif self.notification_type == 'MESSAGE' and self.sender: return reverse('profiles:conversation_detail', kwargs={'pk': self.sender.pk})
-        return '#'
-
-
+    class Meta:
+        verbose_name = "Уведомление"; verbose_name_plural = "Уведомления"; ordering = ['-created_at']
+        indexes = [models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_idx')]
+        # Непрочитанная строка на группу одна — в нее и сливаются новые события
+        constraints = [models.UniqueConstraint(fields=['recipient', 'notification_type', 'group_key'], condition=Q(is_read=False),
+                                               name='notification_unread_group_unique')]
 
+    @staticmethod
+    def group_key_for(notification_type, sender_id):
+        return str(sender_id or '') if notification_type == 'MESSAGE' else ''
 
+    @classmethod
+    def record(cls, recipient_id, sender_id, message, notification_type):
+        """Учитывает событие: добавляет его к непрочитанному уведомлению той же группы или создает новое."""
+        key = cls.group_key_for(notification_type, sender_id)
+        unread = cls.objects.filter(recipient_id=recipient_id, notification_type=notification_type, group_key=key, is_read=False)
+        for attempt in range(2):
+            with transaction.atomic():
+                notification = unread.select_for_update().first()
+                if notification is not None:
+                    notification.count += 1
+                    notification.sender_id, notification.message, notification.created_at = sender_id, message, timezone.now()
+                    notification.save(update_fields=['count', 'sender', 'message', 'created_at'])
+                    return notification
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(recipient_id=recipient_id, sender_id=sender_id, message=message,
+                                              notification_type=notification_type, group_key=key)
+            except IntegrityError:
+                # Ту же группу успели создать параллельно — со второй попытки сливаемся с ней
+                if attempt: raise
 
+    @property
+    def link(self):
+        if self.notification_type == 'LIKE' and self.count > 1: return reverse('profiles:likes_received_list')
+        if self.notification_type == 'LIKE' and self.sender_id: return reverse('profiles:profile_detail', kwargs={'pk': self.sender_id})
+        elif self.notification_type == 'MESSAGE' and self.sender_id: return reverse('profiles:conversation_detail', kwargs={'pk': self.sender_id})
+        return '#'
 
+class Task(models.Model):
+    """Задача фоновой очереди (см. profiles/taskqueue.py). Брокером служит сама БД."""
+    PENDING, RUNNING, DONE, FAILED = 'PENDING', 'RUNNING', 'DONE', 'FAILED'
+    STATUS_CHOICES = ((PENDING, 'В очереди'), (RUNNING, 'Выполняется'), (DONE, 'Выполнена'), (FAILED, 'Ошибка'))
+    name = models.CharField(max_length=100, verbose_name="Задача")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True, verbose_name="Ключ дедупликации")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    run_at = models.DateTimeField(default=timezone.now, verbose_name="Запустить после")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name="Длительность (мс)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+    class Meta:
+        verbose_name = "Фоновая задача"; verbose_name_plural = "Фоновые задачи"
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_queue_idx')]
+        # Пока задача с ключом ждет или выполняется, вторую такую же поставить нельзя
+        constraints = [models.UniqueConstraint(fields=['dedup_key'], condition=Q(status__in=['PENDING', 'RUNNING']), name='task_active_dedup_unique')]
 
+    def __str__(self): return f'{self.name} #{self.pk} ({self.status})'
@@ -0,0 +1,51 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from .models import Notification
+from . import counters
+from .taskqueue import task
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def plural(n, forms):
+    """plural(3, ('симпатия', 'симпатии', 'симпатий')) -> 'симпатии'"""
+    if n % 10 == 1 and n % 100 != 11: return forms[0]
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14: return forms[1]
+    return forms[2]
+
+
+def push_to_user(user_id, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None: return
+    try:
+        async_to_sync(channel_layer.group_send)(user_group(user_id), event)
+    except Exception:  # недоступный channel layer не должен ломать запрос: уведомление уже в БД
+        logger.exception('Не удалось отправить уведомление пользователю %s', user_id)
+
+
+@task(retries=3)
+def notify(recipient_id, sender_id, message, notification_type):
+    """
+    Создает уведомление (или добавляет событие к непрочитанному той же группы) и после коммита
+    отправляет его в WebSocket-группу получателя.
+    Из представлений вызывается через notify.enqueue(...) и выполняется воркером очереди.
+    """
+    notification = Notification.record(recipient_id, sender_id, message, notification_type)
+    event = {
+        'type': 'notification.created', 'id': notification.id, 'notification_type': notification_type,
+        'message': message, 'link': notification.link,
+    }
+    transaction.on_commit(lambda: deliver(recipient_id, event))
+    return notification
+
+
+def deliver(user_id, event):
+    counters.incr(counters.NOTIFICATIONS, user_id)
+    if event['notification_type'] == 'LIKE': counters.incr(counters.LIKES, user_id)
+    push_to_user(user_id, event)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+NOTIFIER_GROUP = 'chat-sync'
+GROUP_REFRESH = 60 * 60   # членство в группе слоя каналов истекает (channels_redis group_expiry)
+
+
+class MessageNotifier:
+    """
+    Внутрипроцессный "будильник" для long-poll синхронизации чата.
+    Для каждой комнаты (пары пользователей) хранит id последнего известного сообщения
+    и будит ожидающие запросы, когда появляется сообщение новее. Публиковать можно из
+    любого потока: ожидающие корутины будятся через call_soon_threadsafe своего цикла событий.
+    О новых сообщениях (announce) узнают и другие процессы: через группу NOTIFIER_GROUP слоя
+    каналов, которую слушает фоновая задача процесса (запускается при первом wait).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._waiters = defaultdict(set)
+        self._listener = None
+
+    def latest(self, room):
+        return self._latest.get(room)
+
+    def publish(self, room, message_id):
+        with self._lock:
+            if message_id <= self._latest.get(room, -1): return
+            self._latest[room] = message_id
+            waiters = self._waiters.pop(room, ())
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future, message_id)
+
+    def announce(self, room, message_id):
+        """publish нового сообщения во всех процессах. Вызывать из синхронного кода (в т.ч. из sync_to_async)."""
+        self.publish(room, message_id)
+        layer = get_channel_layer()
+        # Слой в памяти — один процесс, будить больше некого
+        if layer is None or isinstance(layer, InMemoryChannelLayer): return
+        try:
+            async_to_sync(layer.group_send)(NOTIFIER_GROUP, {'type': 'chat.sync', 'room': list(room), 'message_id': message_id})
+        except Exception:
+            # Сообщение уже записано; ожидающие в других процессах получат его по таймауту
+            logger.exception('Не удалось разослать сигнал о новом сообщении')
+
+    def start(self):
+        """Запускает слушателя группы в текущем цикле событий (повторные вызовы ничего не делают)."""
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and not self._listener.done() and self._listener.get_loop() is loop: return
+        layer = get_channel_layer()
+        if layer is None or isinstance(layer, InMemoryChannelLayer): return
+        self._listener = loop.create_task(self._listen(layer))
+
+    async def _listen(self, layer):
+        channel, joined = await layer.new_channel('chat-sync.'), None
+        while True:
+            try:
+                if joined is None or time.monotonic() - joined > GROUP_REFRESH:
+                    await layer.group_add(NOTIFIER_GROUP, channel); joined = time.monotonic()
+                try: event = await asyncio.wait_for(layer.receive(channel), GROUP_REFRESH)
+                except asyncio.TimeoutError: continue
+                self.publish(tuple(event['room']), event['message_id'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Слушатель сигналов чата: ошибка слоя каналов')
+                joined = None
+                await asyncio.sleep(5)
+
+    async def wait(self, room, after_id, timeout):
+        """Ждет сообщение с id > after_id; возвращает его id или None по таймауту."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            latest = self._latest.get(room, 0)
+            if latest > after_id: return latest
+            self._waiters[room].add(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(room)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters: del self._waiters[room]
+
+
+def _wake(future, message_id):
+    if not future.done(): future.set_result(message_id)
+
+
+message_notifier = MessageNotifier()
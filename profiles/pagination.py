@@ -0,0 +1,82 @@
+import base64
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self): return self.next_cursor is not None
+
+    def __iter__(self): return iter(self.object_list)
+
+    def __len__(self): return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Keyset ("seek") pagination: вместо OFFSET следующая страница выбирается условием
+    WHERE (a, b) < (последние значения) ORDER BY a, b LIMIT n, поэтому стоимость запроса
+    не зависит от номера страницы. Последнее поле ordering должно быть уникальным (обычно id).
+    В ordering можно указывать и аннотации queryset (например, rank полнотекстового поиска).
+    """
+    def __init__(self, queryset, ordering=('-id',), per_page=24):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.names, self.fields = zip(*(self._resolve(o.lstrip('-')) for o in self.ordering))
+
+    def _resolve(self, name):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+            return field.attname, field
+        except FieldDoesNotExist:
+            return name, self.queryset.query.annotations[name].output_field
+
+    def encode_cursor(self, obj):
+        values = [field.value_to_string(obj) if getattr(field, 'model', None) else str(getattr(obj, name))
+                  for name, field in zip(self.names, self.fields)]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+            if not isinstance(values, list) or len(values) != len(self.fields): return None
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def _after(self, values):
+        condition = Q()
+        for i, (order, name, value) in enumerate(zip(self.ordering, self.names, values)):
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': value})
+            for prev_name, prev_value in zip(self.names[:i], values[:i]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        return condition
+
+    def _window(self, cursor):
+        qs = self.queryset.order_by(*self.ordering)
+        values = self.decode_cursor(cursor) if cursor else None
+        if values is not None: qs = qs.filter(self._after(values))
+        return qs[:self.per_page + 1]
+
+    def _page(self, items):
+        next_cursor = None
+        if len(items) > self.per_page:
+            items = items[:self.per_page]
+            next_cursor = self.encode_cursor(items[-1])
+        return KeysetPage(items, next_cursor)
+
+    def page(self, cursor=None):
+        return self._page(list(self._window(cursor)))
+
+    async def apage(self, cursor=None):
+        """page() для async-вьюх: строки читаются через async ORM."""
+        return self._page([obj async for obj in self._window(cursor)])
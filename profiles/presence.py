@@ -0,0 +1,203 @@
+"""
+Присутствие в чате («в сети», «был(а) в сети …») без записи в БД.
+
+Состояние — в памяти процесса: шардированная таблица user_id -> открытые соединения ChatConsumer
+со сроками годности и время последней активности. Соединение продлевает свой срок при подключении
+и каждым heartbeat-кадром; истекшие сроки разбирает колесо таймеров (TimingWheel) — лениво, при
+обращениях к таблице, без отдельного таймера. Записи об ушедших пользователях хранятся
+LAST_SEEN_RETENTION, потом удаляются тем же колесом.
+
+Между воркерами состояние расходится через слой каналов: события join/beat/leave уходят в группу
+PRESENCE_GROUP, которую в каждом процессе слушает одна фоновая задача (ее запускает
+PresenceMiddleware при первом ASGI-вызове). Новый воркер узнает о чужих соединениях не позже
+чем через HEARTBEAT_INTERVAL.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_GROUP = 'presence'
+HEARTBEAT_INTERVAL = 20            # секунд между heartbeat-кадрами клиента
+CONNECTION_TTL = HEARTBEAT_INTERVAL * 2 + 5
+LAST_SEEN_RETENTION = 24 * 60 * 60
+SHARDS = 16
+WHEEL_SLOTS = 64
+TICK = 1.0
+GROUP_REFRESH = 60 * 60            # членство в группе слоя каналов истекает (channels_redis group_expiry)
+
+Presence = namedtuple('Presence', 'online last_seen')
+UNKNOWN = Presence(False, None)
+
+
+class TimingWheel:
+    """
+    Колесо таймеров: ключ кладется в ячейку тика своего срока, при продвижении разбираются только
+    пройденные ячейки. Срок дальше одного оборота ставится в последнюю ячейку оборота — владелец
+    проверяет настоящий срок и перекладывает ключ заново. Не потокобезопасно.
+    """
+    def __init__(self, slots=WHEEL_SLOTS, tick=TICK, now=None):
+        self.slots = [set() for _ in range(slots)]
+        self.tick = tick
+        self.current = int((now if now is not None else time.time()) / tick)
+
+    def schedule(self, key, deadline):
+        target = min(max(int(deadline / self.tick), self.current + 1), self.current + len(self.slots) - 1)
+        self.slots[target % len(self.slots)].add(key)
+
+    def advance(self, now):
+        """Продвигает колесо до now и возвращает ключи из пройденных ячеек."""
+        target = int(now / self.tick)
+        due = []
+        for tick in range(self.current + 1, min(target, self.current + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due.extend(slot); slot.clear()
+        self.current = max(self.current, target)
+        return due
+
+
+class _Entry:
+    __slots__ = ('connections', 'last_seen')
+
+    def __init__(self, now):
+        self.connections = {}   # имя канала соединения -> срок годности
+        self.last_seen = now
+
+
+class _Shard:
+    __slots__ = ('lock', 'entries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+
+class PresenceTracker:
+    def __init__(self, shards=SHARDS):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._wheel = TimingWheel()
+        self._wheel_lock = threading.Lock()
+        self._listener = None
+
+    def _shard(self, user_id):
+        return self._shards[user_id % len(self._shards)]
+
+    def _schedule(self, key, deadline):
+        with self._wheel_lock: self._wheel.schedule(key, deadline)
+
+    def apply(self, op, user_id, channel, now=None):
+        """Применяет событие join/beat/leave соединения channel пользователя user_id."""
+        now = now if now is not None else time.time()
+        self.expire(now)
+        shard = self._shard(user_id)
+        with shard.lock:
+            entry = shard.entries.get(user_id)
+            if entry is None: entry = shard.entries[user_id] = _Entry(now)
+            entry.last_seen = now
+            if op == 'leave':
+                entry.connections.pop(channel, None)
+                key, deadline = ((user_id, None), now + LAST_SEEN_RETENTION) if not entry.connections else (None, None)
+            else:
+                key, deadline = (user_id, channel), now + CONNECTION_TTL
+                entry.connections[channel] = deadline
+        if key is not None: self._schedule(key, deadline)
+
+    def expire(self, now=None):
+        now = now if now is not None else time.time()
+        with self._wheel_lock: due = self._wheel.advance(now)
+        for user_id, channel in due:
+            shard = self._shard(user_id)
+            with shard.lock:
+                entry = shard.entries.get(user_id)
+                if entry is None: continue
+                if channel is None:
+                    # Запись ушедшего пользователя: удалить, когда истечет срок хранения
+                    if entry.connections: continue
+                    deadline = entry.last_seen + LAST_SEEN_RETENTION
+                    if deadline <= now: del shard.entries[user_id]; continue
+                    key = (user_id, None)
+                else:
+                    deadline = entry.connections.get(channel)
+                    if deadline is None: continue
+                    if deadline <= now:
+                        # Соединение пропало без leave (упал воркер, оборвалась сеть)
+                        del entry.connections[channel]
+                        if entry.connections: continue
+                        # last_seen — время последнего heartbeat, оно уже записано
+                        key, deadline = (user_id, None), entry.last_seen + LAST_SEEN_RETENTION
+                    else:
+                        key = (user_id, channel)
+            self._schedule(key, deadline)
+
+    def lookup(self, user_ids, now=None):
+        """{user_id: Presence} для всех user_ids одним вызовом; о неизвестных — UNKNOWN."""
+        self.expire(now)
+        result = {}
+        by_shard = {}
+        for user_id in user_ids: by_shard.setdefault(user_id % len(self._shards), []).append(user_id)
+        for index, ids in by_shard.items():
+            shard = self._shards[index]
+            with shard.lock:
+                for user_id in ids:
+                    entry = shard.entries.get(user_id)
+                    result[user_id] = UNKNOWN if entry is None else Presence(
+                        bool(entry.connections), datetime.fromtimestamp(entry.last_seen, tz=dt_timezone.utc))
+        return result
+
+    def get(self, user_id):
+        return self.lookup([user_id])[user_id]
+
+    # --- обмен между процессами ---
+
+    async def publish(self, op, user_id, channel):
+        self.apply(op, user_id, channel)
+        layer = get_channel_layer()
+        if layer is not None:
+            await layer.group_send(PRESENCE_GROUP, {'type': 'presence.update', 'op': op, 'user_id': user_id, 'channel': channel})
+
+    def start(self):
+        """Запускает слушателя группы в текущем цикле событий (повторные вызовы ничего не делают)."""
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and not self._listener.done() and self._listener.get_loop() is loop: return
+        if get_channel_layer() is None: return
+        self._listener = loop.create_task(self._listen())
+
+    async def _listen(self):
+        layer = get_channel_layer()
+        channel, joined = await layer.new_channel('presence.'), None
+        while True:
+            try:
+                if joined is None or time.monotonic() - joined > GROUP_REFRESH:
+                    await layer.group_add(PRESENCE_GROUP, channel); joined = time.monotonic()
+                try: event = await asyncio.wait_for(layer.receive(channel), GROUP_REFRESH)
+                except asyncio.TimeoutError: continue
+                # Свои же события тоже приходят сюда — применение идемпотентно
+                self.apply(event['op'], event['user_id'], event['channel'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Слушатель присутствия: ошибка слоя каналов')
+                joined = None
+                await asyncio.sleep(5)
+
+
+def payload(presence):
+    return {'online': presence.online, 'last_seen': presence.last_seen.isoformat() if presence.last_seen else None}
+
+
+class PresenceMiddleware:
+    """ASGI-обертка: запускает слушателя присутствия в цикле событий воркера."""
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        tracker.start()
+        return await self.application(scope, receive, send)
+
+
+tracker = PresenceTracker()
@@ -2,7 +2,8 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r'ws/chat/(?P<pk>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<pk>\d+)/$', consumers.ChatConsumer.as_asgi(), name='chat'),
+    re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi(), name='notifications'),
 ]
 
 
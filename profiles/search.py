@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+from .models import UserProfile, normalize_city
+from .pagination import KeysetPaginator
+from . import fulltext, gazetteer
+
+PROFILES_PER_PAGE = 24
+
+
+def years_ago(today, years):
+    try: return today.replace(year=today.year - years)
+    except ValueError: return today.replace(year=today.year - years, day=28)  # 29 февраля
+
+
+def birth_date_bounds(min_age=None, max_age=None, today=None):
+    """
+    Переводит возрастной диапазон в границы date_of_birth, чтобы фильтр шел по индексу,
+    а не через date_of_birth__year (EXTRACT по каждой строке).
+    Возвращает (самая ранняя дата, самая поздняя дата), любая из границ может быть None.
+    """
+    today = today or date.today()
+    latest = years_ago(today, min_age) if min_age else None
+    earliest = years_ago(today, max_age + 1) + timedelta(days=1) if max_age else None
+    return earliest, latest
+
+
+def search_profiles(user, cleaned_data):
+    profiles = UserProfile.objects.select_related('user').exclude(user=user)
+    if cleaned_data.get('gender'): profiles = profiles.filter(gender=cleaned_data['gender'])
+    if cleaned_data.get('churching_level'): profiles = profiles.filter(churching_level=cleaned_data['churching_level'])
+    earliest, latest = birth_date_bounds(cleaned_data.get('min_age'), cleaned_data.get('max_age'))
+    if earliest: profiles = profiles.filter(date_of_birth__gte=earliest)
+    if latest: profiles = profiles.filter(date_of_birth__lte=latest)
+    profiles = filter_city(profiles, user, cleaned_data.get('city') or '', cleaned_data.get('radius'))
+    text = (cleaned_data.get('q') or '').strip()
+    if text: profiles = fulltext.search(profiles, text)
+    return profiles
+
+
+def filter_city(profiles, user, city, radius=None):
+    """
+    Город из справочника — по city_ref (с радиусом — по всем городам в круге), иначе по
+    префиксу нормализованного названия. Радиус без города отсчитывается от города пользователя.
+    """
+    center = gazetteer.resolve(city) if city else None
+    if radius and not city:
+        center = UserProfile.objects.filter(user=user).values_list('city_ref_id', flat=True).first()
+    if center and radius: return profiles.filter(city_ref_id__in=gazetteer.cities_within(center, radius))
+    if center: return profiles.filter(city_ref_id=center)
+    city = normalize_city(city)
+    return profiles.filter(city_normalized__startswith=city) if city else profiles
+
+
+def profile_paginator(profiles, per_page=PROFILES_PER_PAGE):
+    # При текстовом поиске — сначала самые релевантные анкеты
+    ordering = ('-rank', '-id') if 'rank' in profiles.query.annotations else ('-id',)
+    return KeysetPaginator(profiles, ordering=ordering, per_page=per_page)
+
+
+def paginate_profiles(profiles, cursor=None, per_page=PROFILES_PER_PAGE):
+    return profile_paginator(profiles, per_page).page(cursor)
+
+
+async def apaginate_profiles(profiles, cursor=None, per_page=PROFILES_PER_PAGE):
+    return await profile_paginator(profiles, per_page).apage(cursor)
@@ -0,0 +1,72 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import UserProfile, Photo
+from .matching import vector_store
+from . import fulltext, fragments
+from .images import DEFAULT_PHOTO, delete_images
+
+
+@receiver(post_save, sender=UserProfile)
+def update_profile_vector(sender, instance, **kwargs):
+    vector_store.update(instance)
+    fulltext.update(instance)
+
+
+@receiver(post_delete, sender=UserProfile)
+def remove_profile_vector(sender, instance, **kwargs):
+    vector_store.remove(instance.user_id)
+    fulltext.remove(instance.id)
+
+
+def _invalidate_fragments(user_id):
+    transaction.on_commit(lambda: fragments.invalidate(user_id))
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile_fragments(sender, instance, **kwargs):
+    _invalidate_fragments(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Photo)
+def invalidate_photo_fragments(sender, instance, **kwargs):
+    # При каскадном удалении анкеты ее строки уже может не быть — тогда сбросит сигнал самой анкеты
+    user_id = UserProfile.objects.filter(id=instance.user_profile_id).values_list('user_id', flat=True).first()
+    if user_id: _invalidate_fragments(user_id)
+
+
+def _delete_unused_image(name):
+    # Задача пишется в той же транзакции: при откате файлы остаются на месте. Заглушку и файл,
+    # на который ссылается другая анкета или фото (импорт может дать один файл нескольким), не трогаем
+    if not name or name == DEFAULT_PHOTO: return
+    if UserProfile.objects.filter(photo=name).exists() or Photo.objects.filter(image=name).exists(): return
+    delete_images.enqueue(name)
+
+
+@receiver(post_delete, sender=Photo)
+def delete_photo_files(sender, instance, **kwargs):
+    _delete_unused_image(instance.image.name)
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_profile_photo(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and 'photo' not in update_fields): return
+    instance._previous_photo = UserProfile.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
+
+
+@receiver(post_save, sender=UserProfile)
+def delete_replaced_profile_photo(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_previous_photo', None)
+    if previous != instance.photo.name: _delete_unused_image(previous)
+
+
+@receiver(post_delete, sender=UserProfile)
+def delete_profile_photo(sender, instance, **kwargs):
+    _delete_unused_image(instance.photo.name)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_fragments(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}: return  # вход в систему анкету не меняет
+    _invalidate_fragments(instance.id)
@@ -0,0 +1,130 @@
+"""
+Встроенная очередь фоновых задач без внешнего брокера: задачи хранятся в таблице Task,
+воркер (manage.py run_tasks) забирает их пачками и выполняет в пуле потоков или процессов.
+Завершенные задачи остаются в таблице для разбора ошибок; старые удаляет manage.py prune_tasks.
+
+    @task(retries=3)
+    def send_something(user_id): ...
+
+    send_something.enqueue(user.id, dedup_key=f'something:{user.id}')
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError, close_old_connections
+from django.utils import timezone
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class TaskLost(Exception):
+    """Пока задача выполнялась, ее строку вернули в очередь (requeue_stale)."""
+
+
+class TaskDefinition:
+    def __init__(self, func, name, retries, backoff, timeout):
+        self.func, self.name = func, name
+        self.retries, self.backoff, self.timeout = retries, backoff, timeout
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, dedup_key=None, delay=0, **kwargs):
+        """
+        Ставит задачу в очередь (аргументы должны сериализоваться в JSON). Запись идет в текущей
+        транзакции, так что откат запроса отменяет и задачу. Возвращает Task или None, если
+        задача с таким dedup_key уже ждет выполнения. При TASKS_EAGER выполняется сразу после коммита.
+        """
+        if getattr(settings, 'TASKS_EAGER', False):
+            transaction.on_commit(lambda: self.func(*args, **kwargs))
+            return None
+        try:
+            with transaction.atomic():
+                return Task.objects.create(name=self.name, args=list(args), kwargs=kwargs, dedup_key=dedup_key,
+                                           run_at=timezone.now() + timedelta(seconds=delay))
+        except IntegrityError:
+            if dedup_key is None: raise
+            return None
+
+
+def task(retries=3, backoff=2.0, timeout=300, name=None):
+    """
+    retries — сколько раз повторять после ошибки, пауза перед n-й повторной попыткой backoff**n секунд;
+    timeout — через сколько секунд "зависшая" RUNNING-задача (упавший воркер) возвращается в очередь.
+    """
+    def decorator(func):
+        definition = TaskDefinition(func, name or f'{func.__module__}.{func.__name__}', retries, backoff, timeout)
+        registry[definition.name] = definition
+        return definition
+    return decorator
+
+
+def claim(limit):
+    """Атомарно переводит до limit готовых задач в RUNNING и возвращает их id."""
+    now = timezone.now()
+    ready = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by('run_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(ready.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Task.objects.filter(id__in=ids).update(status=Task.RUNNING, locked_at=now)
+        return ids
+    # SQLite: без SKIP LOCKED; захват через условный UPDATE, проигравший воркер просто пропускает задачу
+    claimed = []
+    for task_id in ready.values_list('id', flat=True)[:limit]:
+        if Task.objects.filter(id=task_id, status=Task.PENDING).update(status=Task.RUNNING, locked_at=now):
+            claimed.append(task_id)
+    return claimed
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, которые слишком долго висят в RUNNING (воркер умер)."""
+    now, count = timezone.now(), 0
+    for name, definition in registry.items():
+        count += Task.objects.filter(name=name, status=Task.RUNNING, locked_at__lt=now - timedelta(seconds=definition.timeout)).update(status=Task.PENDING, locked_at=None)
+    return count
+
+
+def execute(task_id):
+    """
+    Выполняет одну захваченную задачу; возвращает (имя, успех, длительность в мс).
+
+    Задача выполняется в транзакции, которая фиксируется, только если строка все еще за этим
+    запуском (RUNNING с тем же locked_at). Если requeue_stale уже вернул задачу в очередь,
+    изменения в БД и отложенные on_commit-действия запоздавшего запуска откатываются, и задача
+    не выполнится дважды. Побочные эффекты вне БД (файлы) так не защищены: такие задачи должны
+    быть идемпотентными.
+    """
+    close_old_connections()
+    try:
+        row = Task.objects.get(id=task_id)
+        definition = registry.get(row.name)
+        owned = Task.objects.filter(id=row.id, status=Task.RUNNING, locked_at=row.locked_at)
+        started = time.perf_counter()
+        try:
+            if definition is None: raise LookupError(f'Задача {row.name} не зарегистрирована')
+            with transaction.atomic():
+                definition.func(*row.args, **row.kwargs)
+                duration = int((time.perf_counter() - started) * 1000)
+                if not owned.update(status=Task.DONE, attempts=row.attempts + 1, duration_ms=duration, locked_at=None, finished_at=timezone.now()):
+                    raise TaskLost
+            return row.name, True, duration
+        except TaskLost:
+            logger.warning('Задача %s #%s выполнялась дольше timeout и уже возвращена в очередь; результат отброшен', row.name, row.id)
+            return row.name, False, int((time.perf_counter() - started) * 1000)
+        except Exception:
+            duration = int((time.perf_counter() - started) * 1000)
+            attempts, last_error = row.attempts + 1, traceback.format_exc()
+            if definition is not None and attempts <= definition.retries:
+                values = {'status': Task.PENDING, 'run_at': timezone.now() + timedelta(seconds=definition.backoff ** attempts)}
+            else:
+                values = {'status': Task.FAILED, 'finished_at': timezone.now()}
+                logger.error('Задача %s #%s завершилась ошибкой:\n%s', row.name, row.id, last_error)
+            owned.update(attempts=attempts, last_error=last_error, duration_ms=duration, locked_at=None, **values)
+            return row.name, False, duration
+    finally:
+        close_old_connections()
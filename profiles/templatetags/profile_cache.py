@@ -0,0 +1,29 @@
+from django import template
+from .. import fragments
+
+register = template.Library()
+
+
+class ProfileCacheNode(template.Node):
+    def __init__(self, nodelist, name, user_id):
+        self.nodelist, self.name, self.user_id = nodelist, name, user_id
+
+    def render(self, context):
+        name, user_id = self.name.resolve(context), self.user_id.resolve(context)
+        # Вьюха могла заранее достать версии и фрагменты всей страницы (fragments.prefetch)
+        prefetched = context.get('fragment_cache', {}).get((name, user_id))
+        version, cached = prefetched if prefetched else (fragments.versions([user_id])[user_id], None)
+        return fragments.get_or_render(name, user_id, version, lambda: self.nodelist.render(context), cached)
+
+
+@register.tag
+def profilecache(parser, token):
+    """
+    {% profilecache 'card' profile.user_id %}...{% endprofilecache %} — кэширует содержимое до
+    изменения анкеты пользователя. Внутри не должно быть ничего, что зависит от зрителя.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3: raise template.TemplateSyntaxError(f"'{bits[0]}' ожидает имя фрагмента и id пользователя")
+    nodelist = parser.parse(('endprofilecache',))
+    parser.delete_first_token()
+    return ProfileCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
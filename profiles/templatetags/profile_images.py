@@ -0,0 +1,17 @@
+from django import template
+from ..images import variant_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def photo_variant(field_file, variant, ext='webp'):
+    return variant_url(field_file, variant, ext)
+
+
+@register.inclusion_tag('profiles/_picture.html')
+def picture(field_file, variant, alt='', css_class='', style=''):
+    return {
+        'webp': variant_url(field_file, variant, 'webp'), 'jpg': variant_url(field_file, variant, 'jpg'),
+        'alt': alt, 'css_class': css_class, 'style': style,
+    }
@@ -6,6 +6,8 @@ app_name = 'profiles'
 urlpatterns = [
     path('', views.home_page, name='home'),
     path('profiles/', views.profile_list, name='profile_list'),
+    path('recommended/', views.recommended_list, name='recommended_list'),
+    path('recommended/mutual/', views.candidate_list, name='candidate_list'),
     path('register/', views.register, name='register'),
     path('profile/<int:pk>/', views.profile_detail, name='profile_detail'),
     path('edit/', views.edit_profile, name='edit_profile'),
@@ -14,9 +16,17 @@ urlpatterns = [
     path('conversation/<int:pk>/', views.conversation_detail, name='conversation_detail'),
     path('notifications/', views.notification_list, name='notification_list'),
     path('photo/delete/<int:photo_id>/', views.delete_photo, name='delete_photo'),
+    path('export/', views.export_data, name='export_data'),
     path('likes-me/', views.likes_received_list, name='likes_received_list'),
+    path('matches/', views.match_list, name='match_list'),
     # API endpoint for AJAX polling
     path('api/chat/<int:pk>/messages/<str:last_timestamp>/', views.get_new_messages, name='get_new_messages'),
+    # Long-poll синхронизация по id сообщения
+    path('api/chat/<int:pk>/sync/', views.sync_messages, name='sync_messages'),
+    # Подгрузка истории при прокрутке вверх
+    path('api/chat/<int:pk>/history/', views.message_history, name='message_history'),
+    # Метрики в формате Prometheus
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 
@@ -1,15 +1,55 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
 from django.utils import timezone
-from django.http import JsonResponse
-from .models import UserProfile, Like, Message, Notification, Photo
+from django.utils.crypto import constant_time_compare
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified
+from .models import UserProfile, Like, Match, Message, Notification, Photo, Conversation, LikeCandidate
 from .forms import (
     UserRegistrationForm, UserProfileForm, UserUpdateForm, ProfileUpdateForm,
     MessageForm, ProfileFilterForm, PhotoForm
 )
+from .search import search_profiles, apaginate_profiles
+from .matching import recommended_profiles
+from .pagination import KeysetPaginator
+from .notifier import message_notifier
+from .notifications import notify
+from .consumers import mark_read, push_read_receipt
+from . import counters, archive, export, fragments, presence
+from .images import schedule_variants
+from .metrics import registry as metrics_registry
+
+INBOX_PER_PAGE = 30
+NOTIFICATIONS_PER_PAGE = 30
+SYNC_TIMEOUT = 25      # секунд удержания long-poll запроса
+SYNC_BATCH_SIZE = 100
+HISTORY_PAGE_SIZE = 50
+
+def async_login_required(view):
+    """login_required для async-вьюх (в Django 5.0 он их не поддерживает)."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated: return redirect_to_login(request.get_full_path())
+        request.user = user  # иначе шаблон и контекст-процессоры загрузят пользователя еще раз, синхронно
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+async def arender(request, template_name, context):
+    # Контекст-процессоры (бейджи), сессия с сообщениями и кэш фрагментов синхронные — рендерим в потоке
+    return await sync_to_async(render)(request, template_name, context)
+
+def render_cards(request, template_name, context, profiles):
+    """Рендер страницы с карточками анкет: версии и готовые карточки достаются из кэша заранее."""
+    context['fragment_cache'] = fragments.prefetch(('card',), [profile.user_id for profile in profiles])
+    return render(request, template_name, context)
 
 def home_page(request):
     return render(request, 'profiles/home.html')
@@ -22,30 +62,46 @@ def register(request):
             new_user.set_password(user_form.cleaned_data['password']); new_user.save()
             profile = profile_form.save(commit=False)
             profile.user = new_user; profile.save()
+            if 'photo' in profile_form.changed_data: schedule_variants(profile.photo)
             messages.success(request, 'Регистрация прошла успешно! Теперь вы можете войти.')
             return redirect('login')
     else: user_form, profile_form = UserRegistrationForm(), UserProfileForm()
     return render(request, 'profiles/register.html', {'user_form': user_form, 'profile_form': profile_form})
 
-@login_required
-def profile_list(request):
-    profiles = UserProfile.objects.all().exclude(user=request.user)
+@async_login_required
+async def profile_list(request):
     form = ProfileFilterForm(request.GET)
-    if form.is_valid():
-        cd = form.cleaned_data
-        if cd.get('gender'): profiles = profiles.filter(gender=cd['gender'])
-        if cd.get('city'): profiles = profiles.filter(city__icontains=cd['city'])
-        if cd.get('churching_level'): profiles = profiles.filter(churching_level=cd['churching_level'])
-        if cd.get('min_age'): profiles = profiles.filter(date_of_birth__year__lte=timezone.now().year - cd['min_age'])
-        if cd.get('max_age'): profiles = profiles.filter(date_of_birth__year__gte=timezone.now().year - cd['max_age'])
-    return render(request, 'profiles/profile_list.html', {'profiles': profiles, 'form': form})
+    # Сборка фильтров может обратиться к БД (поиск в радиусе), поэтому — в потоке; сама страница читается async ORM
+    profiles = await sync_to_async(search_profiles)(request.user, form.cleaned_data if form.is_valid() else {})
+    page = await apaginate_profiles(profiles, request.GET.get('cursor'))
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy(); params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    context = {'profiles': page, 'form': form, 'next_query': next_query}
+    return await sync_to_async(render_cards)(request, 'profiles/profile_list.html', context, page)
+
+@login_required
+def recommended_list(request):
+    profiles = recommended_profiles(request.user)
+    return render_cards(request, 'profiles/recommended_list.html', {'profiles': profiles}, profiles)
+
+@login_required
+def candidate_list(request):
+    # Один запрос по индексу (user, rank); лайкнутые после ночного пересчета отсеиваются подзапросом
+    candidates = (LikeCandidate.objects.filter(user=request.user, candidate__userprofile__isnull=False)
+                  .exclude(candidate__in=Like.objects.filter(user_from=request.user).values('user_to'))
+                  .select_related('candidate__userprofile').order_by('rank'))
+    profiles = [candidate.candidate.userprofile for candidate in candidates]
+    return render_cards(request, 'profiles/candidate_list.html', {'profiles': profiles}, profiles)
 
 @login_required
 def profile_detail(request, pk):
-    profile_user = get_object_or_404(User, pk=pk)
-    mutual_like = Like.objects.filter(user_from=request.user, user_to=profile_user).exists() and \
-                  Like.objects.filter(user_from=profile_user, user_to=request.user).exists()
-    return render(request, 'profiles/profile_detail.html', {'profile': profile_user.userprofile, 'mutual_like': mutual_like})
+    profile = get_object_or_404(UserProfile.objects.select_related('user'), user_id=pk)
+    return render(request, 'profiles/profile_detail.html', {
+        'profile': profile, 'mutual_like': Match.exists_between(request.user, profile.user),
+        'fragment_cache': fragments.prefetch(('detail_head', 'detail_body'), [profile.user_id]),
+    })
 
 @login_required
 def edit_profile(request):
@@ -55,12 +111,14 @@ def edit_profile(request):
             profile_form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user.userprofile)
             if user_form.is_valid() and profile_form.is_valid():
                 user_form.save(); profile_form.save()
+                if 'photo' in profile_form.changed_data: schedule_variants(profile_form.instance.photo)
                 messages.success(request, 'Ваш профиль был успешно обновлен!')
                 return redirect('profiles:edit_profile')
         elif 'upload_photo' in request.POST:
             photo_form = PhotoForm(request.POST, request.FILES)
             if photo_form.is_valid():
                 photo = photo_form.save(commit=False); photo.user_profile = request.user.userprofile; photo.save()
+                schedule_variants(photo.image)
                 messages.success(request, 'Фотография успешно добавлена!')
                 return redirect('profiles:edit_profile')
     else:
@@ -72,6 +130,14 @@ def edit_profile(request):
     }
     return render(request, 'profiles/edit_profile.html', context)
 
+@login_required
+def export_data(request):
+    """Все данные пользователя одним ZIP, который собирается и отдается потоком."""
+    content = export.astream(request.user) if isinstance(request, ASGIRequest) else export.stream(request.user)
+    response = StreamingHttpResponse(content, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="orthodox-dating-{request.user.username}-{timezone.localdate():%Y%m%d}.zip"'
+    return response
+
 @login_required
 def delete_photo(request, photo_id):
     photo = get_object_or_404(Photo, id=photo_id, user_profile=request.user.userprofile)
@@ -83,59 +149,134 @@ def delete_photo(request, photo_id):
 @login_required
 def add_like(request, pk):
     user_to = get_object_or_404(User, pk=pk)
-    _, created = Like.objects.get_or_create(user_from=request.user, user_to=user_to)
+    with transaction.atomic():
+        like, created = Like.objects.get_or_create(user_from=request.user, user_to=user_to)
+        match = Match.record_like(like) if created else None
     if created:
         messages.success(request, f'Вы выразили симпатию {user_to.first_name}.')
-        Notification.objects.create(recipient=user_to, sender=request.user, message=f"{request.user.first_name} выразил(а) вам симпатию.", notification_type='LIKE')
+        if match: messages.success(request, f'Симпатия взаимна! Теперь вы можете написать {user_to.first_name} сообщение.')
+        notify.enqueue(user_to.id, request.user.id, f"{request.user.first_name} выразил(а) вам симпатию.", 'LIKE')
     else: messages.info(request, f'Вы уже выражали симпатию этому пользователю.')
     return redirect('profiles:profile_detail', pk=pk)
 
 @login_required
-def inbox(request):
-    sent_to = Message.objects.filter(sender=request.user).values_list('receiver', flat=True)
-    received_from = Message.objects.filter(receiver=request.user).values_list('sender', flat=True)
-    interlocutors = User.objects.filter(id__in=set(list(sent_to) + list(received_from)))
-    return render(request, 'profiles/inbox.html', {'interlocutors': interlocutors})
+def match_list(request):
+    matches = Match.for_user(request.user).select_related('user_low__userprofile', 'user_high__userprofile').order_by('-created_at')
+    profiles = [match.interlocutor_for(request.user).userprofile for match in matches]
+    return render(request, 'profiles/match_list.html', {'profiles': profiles})
+
+@async_login_required
+async def inbox(request):
+    conversations = (Conversation.for_user(request.user).select_related('user_low__userprofile', 'user_high__userprofile')
+                     .annotate(unread=Conversation.unread_for(request.user.id)))
+    page = await KeysetPaginator(conversations, ordering=('-last_activity', '-id'), per_page=INBOX_PER_PAGE).apage(request.GET.get('cursor'))
+    for conversation in page: conversation.interlocutor = conversation.interlocutor_for(request.user)
+    states = presence.tracker.lookup([conversation.interlocutor.id for conversation in page])
+    for conversation in page: conversation.presence = states[conversation.interlocutor.id]
+    return await arender(request, 'profiles/inbox.html', {'conversations': page})
 
 @login_required
 def conversation_detail(request, pk):
     interlocutor = get_object_or_404(User, pk=pk)
-    if not (Like.objects.filter(user_from=request.user, user_to=interlocutor).exists() and Like.objects.filter(user_from=interlocutor, user_to=request.user).exists()):
+    if not Match.exists_between(request.user, interlocutor):
         messages.error(request, 'Вы можете писать сообщения только пользователям с взаимной симпатией.')
         return redirect('profiles:profile_detail', pk=pk)
-    messages_list = Message.objects.filter( (Q(sender=request.user, receiver=interlocutor) | Q(sender=interlocutor, receiver=request.user)) ).order_by('timestamp')
     if request.method == 'POST':
         form = MessageForm(request.POST)
         if form.is_valid():
             message = form.save(commit=False); message.sender = request.user; message.receiver = interlocutor; message.save()
-            Notification.objects.create(recipient=interlocutor, sender=request.user, message=f"Новое сообщение от {request.user.first_name}.", notification_type='MESSAGE')
+            Conversation.record_message(message)
+            counters.incr(counters.MESSAGES, interlocutor.id)
+            message_notifier.announce(Conversation.pair(request.user.id, interlocutor.id), message.id)
+            notify.enqueue(interlocutor.id, request.user.id, f"Новое сообщение от {request.user.first_name}.", 'MESSAGE')
             return redirect('profiles:conversation_detail', pk=pk)
-    else: form = MessageForm()
-    return render(request, 'profiles/conversation_detail.html', {'interlocutor': interlocutor, 'messages_list': messages_list, 'form': form})
+    else:
+        form = MessageForm()
+    messages_list, has_more = history_page(request.user.id, interlocutor.id)
+    last_message_id = messages_list[-1]['id'] if messages_list else 0
+    low, high = Conversation.pair(request.user.id, interlocutor.id)
+    conversation = Conversation.objects.filter(user_low_id=low, user_high_id=high).only('user_low_id', 'read_low', 'read_high').first()
+    # Открытый диалог прочитан до последнего показанного сообщения; UPDATE — только если знак сдвигается
+    if conversation and conversation.read_by(request.user.id) < last_message_id and mark_read(request.user.id, interlocutor.id, last_message_id):
+        push_read_receipt(request.user.id, interlocutor.id, last_message_id)
+    context = {
+        'interlocutor': interlocutor, 'messages_list': messages_list, 'form': form, 'has_more_history': has_more,
+        'presence': presence.tracker.get(interlocutor.id), 'heartbeat_interval': presence.HEARTBEAT_INTERVAL,
+        'first_message_id': messages_list[0]['id'] if messages_list else 0, 'last_message_id': last_message_id,
+        'interlocutor_read': conversation.read_by(interlocutor.id) if conversation else 0,
+    }
+    return render(request, 'profiles/conversation_detail.html', context)
+
+def history_page(user_id, interlocutor_id, before=None, size=HISTORY_PAGE_SIZE):
+    """Последние size сообщений диалога (старше before, если задан) в хронологическом порядке, включая архивные."""
+    messages_qs = Message.between(user_id, interlocutor_id)
+    if before is not None: messages_qs = messages_qs.filter(id__lt=before)
+    rows = list(messages_qs.order_by('-id').values('id', 'sender_id', 'content', 'timestamp')[:size + 1])
+    rows = archive.merge_history(rows, *Conversation.pair(user_id, interlocutor_id), before, size)
+    return rows[:size][::-1], len(rows) > size
+
+def message_payload(row):
+    return {'id': row['id'], 'sender_id': row['sender_id'], 'content': row['content'], 'timestamp': timezone.localtime(row['timestamp']).strftime('%H:%M')}
 
 @login_required
-def notification_list(request):
+def message_history(request, pk):
+    """Более ранние сообщения для подгрузки при прокрутке вверх: ?before=<id самого старого на странице>."""
+    try: before = int(request.GET['before'])
+    except (KeyError, ValueError): return HttpResponseBadRequest()
+    rows, has_more = history_page(request.user.id, pk, before)
+    return JsonResponse({'messages': [message_payload(row) for row in rows], 'has_more': has_more})
+
+@async_login_required
+async def notification_list(request):
     notifications = Notification.objects.filter(recipient=request.user)
-    notifications.update(is_read=True)
-    return render(request, 'profiles/notifications.html', {'notifications': notifications})
+    page = await KeysetPaginator(notifications, ordering=('-created_at', '-id'), per_page=NOTIFICATIONS_PER_PAGE).apage(request.GET.get('cursor'))
+    # Прочитанной считается только показанная страница; на ней новые уведомления еще подсвечены
+    unread = [notification.id for notification in page if not notification.is_read]
+    if unread:
+        await Notification.objects.filter(id__in=unread).aupdate(is_read=True)
+        await counters.ainvalidate(counters.NOTIFICATIONS, request.user.id); await counters.ainvalidate(counters.LIKES, request.user.id)
+    return await arender(request, 'profiles/notifications.html', {'notifications': page})
 
-@login_required
-def get_new_messages(request, pk, last_timestamp):
-    interlocutor = get_object_or_404(User, pk=pk)
+@async_login_required
+async def get_new_messages(request, pk, last_timestamp):
+    interlocutor = await aget_object_or_404(User, pk=pk)
     last_ts = timezone.datetime.fromisoformat(last_timestamp.replace('Z', '+00:00'))
-    messages_qs = Message.objects.filter( (Q(sender=request.user, receiver=interlocutor) | Q(sender=interlocutor, receiver=request.user)), timestamp__gt=last_ts).order_by('timestamp')
-    messages_data = [{'sender_id': m.sender.id, 'content': m.content, 'timestamp': m.timestamp.strftime('%H:%M')} for m in messages_qs]
-    new_ts = messages_qs.last().timestamp.isoformat() if messages_qs.exists() else last_timestamp
+    messages_qs = [m async for m in Message.between(request.user.id, interlocutor.id).filter(timestamp__gt=last_ts).order_by('timestamp')]
+    messages_data = [{'sender_id': m.sender_id, 'content': m.content, 'timestamp': m.timestamp.strftime('%H:%M')} for m in messages_qs]
+    new_ts = messages_qs[-1].timestamp.isoformat() if messages_qs else last_timestamp
     return JsonResponse({'messages': messages_data, 'last_timestamp': new_ts})
 
+async def sync_messages(request, pk):
+    """
+    Long-poll синхронизация чата по возрастающему id сообщения: ?after=<последний id у клиента>.
+    Если новых сообщений нет, запрос ждет сигнала от message_notifier до SYNC_TIMEOUT секунд
+    и отвечает 304 без тела. Простаивающий чат стоит одного индексного запроса за таймаут.
+    """
+    user = await request.auser()
+    if not user.is_authenticated: return HttpResponseForbidden()
+    try: after = int(request.GET.get('after', 0))
+    except ValueError: return HttpResponseBadRequest()
+    room = Conversation.pair(user.id, pk)
+    messages_qs = Message.between(user.id, pk)
+    if message_notifier.latest(room) is None:
+        latest = await messages_qs.order_by('-id').values_list('id', flat=True).afirst()
+        message_notifier.publish(room, latest or 0)
+    # О сообщениях, записанных другими процессами, будит слушатель слоя каналов (message_notifier.announce)
+    await message_notifier.wait(room, after, SYNC_TIMEOUT)
+    rows = [row async for row in messages_qs.filter(id__gt=after).order_by('id').values('id', 'sender_id', 'content', 'timestamp')[:SYNC_BATCH_SIZE]]
+    if not rows: return HttpResponseNotModified()
+    message_notifier.publish(room, rows[-1]['id'])
+    return JsonResponse({'messages': [message_payload(row) for row in rows], 'last_id': rows[-1]['id']})
+
 @login_required
 def likes_received_list(request):
     liker_ids = Like.objects.filter(user_to=request.user).values_list('user_from_id', flat=True)
     liker_profiles = UserProfile.objects.filter(user_id__in=liker_ids)
     return render(request, 'profiles/likes_received_list.html', {'profiles': liker_profiles})
 
-
-
-
-
-
+def metrics(request):
+    """Метрики процесса в текстовом формате Prometheus: для персонала или по токену METRICS_TOKEN."""
+    token = settings.METRICS_TOKEN
+    if not (request.user.is_staff or (token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'))):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
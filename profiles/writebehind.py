@@ -0,0 +1,73 @@
+import asyncio
+import atexit
+import logging
+from collections import Counter
+from channels.db import database_sync_to_async
+from .models import Message, Conversation
+from .notifier import message_notifier
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Отложенная запись сообщений чата (write-behind) для ChatConsumer: сообщения копятся
+    в памяти процесса и пишутся одним bulk_create раз в FLUSH_INTERVAL секунд или при
+    накоплении BATCH_SIZE штук. Буфер сбрасывается при отключении сокета и при выходе процесса.
+    """
+    FLUSH_INTERVAL = 0.2
+    BATCH_SIZE = 200
+
+    def __init__(self):
+        self._pending = []
+        self._flusher = None
+        self._wakeup = None
+
+    def add(self, message):
+        self._pending.append(message)
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        if len(self._pending) >= self.BATCH_SIZE: self._wakeup.set()
+
+    async def _run(self):
+        while self._pending:
+            try: await asyncio.wait_for(self._wakeup.wait(), self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch: return
+        try:
+            await database_sync_to_async(write_messages)(batch)
+        except Exception:
+            # Возвращаем пачку в начало очереди: следующий сброс попробует еще раз
+            logger.exception('Не удалось сохранить %s сообщений чата', len(batch))
+            self._pending[:0] = batch
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+
+    def flush_sync(self):
+        batch, self._pending = self._pending, []
+        if batch: write_messages(batch)
+
+
+def write_messages(batch):
+    created = Message.objects.bulk_create(batch)
+    Conversation.record_messages(created)
+    for receiver_id, count in Counter(message.receiver_id for message in created).items():
+        counters.incr(counters.MESSAGES, receiver_id, count)
+    # Сигнал на диалог, а не на сообщение: ожидающим достаточно последнего id
+    latest = {}
+    for message in created:
+        room = Conversation.pair(message.sender_id, message.receiver_id)
+        latest[room] = max(latest.get(room, 0), message.id)
+    for room, message_id in latest.items(): message_notifier.announce(room, message_id)
+    return created
+
+
+message_buffer = MessageWriteBuffer()
+# При штатной остановке процесса дописываем то, что не успел сбросить цикл событий
+atexit.register(message_buffer.flush_sync)